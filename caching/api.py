@@ -0,0 +1,321 @@
+"""
+A small HTTP client for the APIs that the caching scripts talk to (the GitHub
+REST API and TuxSuite's storage), built on http.client so that it has no
+dependencies.
+
+Every client keeps its connections open between requests (one per host and
+thread), so a script that makes several requests only pays for the TLS
+handshake once. GETs are conditional: the ETag of every response is kept and
+sent back with If-None-Match, a 304 returns the body that was kept, and 304s do
+not count against GitHub's rate limit. Connection errors, 5xx, and 429 (or 403
+from an exhausted rate limit) are retried with exponential backoff and full
+jitter, honoring Retry-After. Requests that are not idempotent (POST and PATCH)
+are only retried when they were not processed: when the connection could not
+be opened or the rate limit turned them away. When the X-RateLimit-* headers
+say that few requests are left, requests are spaced out until the limit resets
+instead of failing once it runs out.
+
+Redirects of GET and HEAD requests are followed like urllib does, without the
+Authorization header if they lead to another host. Redirects of other requests
+are errors.
+
+Errors that are not retried (or that are still there after the last attempt)
+are raised as urllib.error.HTTPError and urllib.error.URLError, like urllib
+does, so callers can handle them in the same way.
+
+Large bodies that only part of is needed (such as build logs) can be read
+incrementally with stream().
+"""
+
+import contextlib
+import http.client
+import io
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+import urllib.error
+import urllib.parse
+
+TIMEOUT = 64
+# How many times a request is retried after the first attempt
+MAX_RETRIES = 5
+# Backoff before retry n (from 0) is random between 0 and
+# min(BACKOFF_CAP, BACKOFF_BASE * 2**n) seconds
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Requests that have the same effect when they are made again, which can be
+# retried even when they may have been processed already
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Same as urllib
+MAX_REDIRECTS = 10
+# Once fewer requests than this are left in the rate limit window, the rest are
+# spread out evenly until it resets
+RATE_LIMIT_LOW = 50
+# Never wait longer than this for the rate limit to reset, a job would rather
+# fail than sit idle until its timeout
+MAX_RATE_LIMIT_WAIT = 15 * 60
+
+
+class ApiClient:
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # url -> (etag, body) of the last successful GET of url
+        self._etags: Dict[str, Tuple[str, bytes]] = {}
+        self._rate_limit_remaining: Optional[int] = None
+        self._rate_limit_reset: Optional[float] = None
+
+    def _connection(self, scheme, netloc, fresh=False):
+        if fresh:
+            self._drop_connection(scheme, netloc)
+        connections = self._local.__dict__.setdefault("connections", {})
+        if (conn := connections.get((scheme, netloc))) is None:
+            cls = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            conn = connections[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def _drop_connection(self, scheme, netloc):
+        connections = self._local.__dict__.setdefault("connections", {})
+        if (conn := connections.pop((scheme, netloc), None)) is not None:
+            conn.close()
+
+    def close(self):
+        for key in list(self._local.__dict__.get("connections", {})):
+            self._drop_connection(*key)
+
+    def _update_rate_limit(self, headers):
+        if (remaining := headers.get("X-RateLimit-Remaining")) is None:
+            return
+        with self._lock:
+            self._rate_limit_remaining = int(remaining)
+            if (reset := headers.get("X-RateLimit-Reset")) is not None:
+                self._rate_limit_reset = float(reset)
+
+    def _throttle(self):
+        with self._lock:
+            remaining = self._rate_limit_remaining
+            reset = self._rate_limit_reset
+        if remaining is None or reset is None or remaining >= RATE_LIMIT_LOW:
+            return
+        if (until_reset := reset - time.time()) <= 0:
+            return
+        # Spread what is left of the window over the rest of it, or wait for
+        # it to reset when nothing is left.
+        delay = until_reset if remaining <= 0 else until_reset / remaining
+        if delay > MAX_RATE_LIMIT_WAIT:
+            return
+        print(
+            f"{remaining} API requests left until the rate limit resets, waiting {delay:.1f}s"
+        )
+        time.sleep(delay)
+
+    @staticmethod
+    def _get_backoff(attempt, headers=None):
+        if headers is not None and (retry_after := headers.get("Retry-After")):
+            try:
+                return min(float(retry_after), MAX_RATE_LIMIT_WAIT)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+    @staticmethod
+    def _should_retry(response, idempotent=True):
+        # A 5xx may come after the request was processed, but a request that
+        # was rate limited was not
+        if response.status in RETRY_STATUSES and (idempotent or response.status == 429):
+            return True
+        # GitHub answers 403 rather than 429 when a rate limit is exhausted
+        return response.status == 403 and (
+            response.headers.get("X-RateLimit-Remaining") == "0"
+            or "Retry-After" in response.headers
+        )
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> bytes:
+        """
+        Makes a request and returns the body of the response. data is sent as
+        is if it is bytes or as JSON if it is anything else but None. headers
+        are added to the ones of the client.
+        """
+        return self.request_with_headers(method, url, data, headers)[0]
+
+    def request_with_headers(
+        self,
+        method: str,
+        url: str,
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[bytes, http.client.HTTPMessage]:
+        """Like request() but returns the headers of the response as well."""
+        return self._request(method, url, data, headers)
+
+    @contextlib.contextmanager
+    def stream(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Iterator[http.client.HTTPResponse]:
+        """
+        Makes a GET request and yields the response with its body unread, to
+        be read as much as is needed. The request is retried like any other
+        but the body is not, and it is not conditional. A connection whose
+        response was not read to the end cannot be reused, so it is closed.
+        """
+        response, _ = self._request("GET", url, None, headers, stream=True)
+        try:
+            yield response
+        finally:
+            if not response.isclosed():
+                # response.url is where it was redirected to, if it was
+                parts = urllib.parse.urlsplit(response.url)
+                self._drop_connection(parts.scheme, parts.netloc)
+
+    def _request(
+        self, method, url, data, headers, stream=False, *, origin=None, redirects=0
+    ):
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        extra_headers = headers
+        headers = {**self.headers, **(headers or {})}
+        # The token of a host is not for the hosts that it redirects to
+        if origin is None:
+            origin = parts.netloc
+        elif parts.netloc != origin:
+            headers.pop("Authorization", None)
+        if isinstance(data, bytes):
+            body = data
+        elif data is not None:
+            body = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        else:
+            body = None
+        cached = self._etags.get(url) if method == "GET" and not stream else None
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+
+        idempotent = method in IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            self._throttle()
+            sent = False
+            try:
+                # A connection that has gone stale while it was idle only
+                # fails once the request has been sent, which cannot be told
+                # apart from a failure after it was processed, so requests
+                # that cannot be retried then get a new one.
+                conn = self._connection(parts.scheme, parts.netloc, not idempotent)
+                if conn.sock is None:
+                    conn.connect()
+                sent = True
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                # A streamed body is left for the caller, unless the response
+                # is an error or is going to be retried
+                if (
+                    stream
+                    and response.status < 300
+                    and not self._should_retry(response)
+                ):
+                    content = None
+                else:
+                    content = response.read()
+            except (http.client.HTTPException, OSError) as err:
+                # Start over with a new connection
+                self._drop_connection(parts.scheme, parts.netloc)
+                if attempt == self.max_retries or (sent and not idempotent):
+                    raise urllib.error.URLError(err) from err
+                delay = self._get_backoff(attempt)
+                print(f"{method} {url} failed ({err}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self._update_rate_limit(response.headers)
+            if response.status == 304 and cached is not None:
+                return cached[1], response.headers
+            if self._should_retry(response, idempotent) and attempt < self.max_retries:
+                delay = self._get_backoff(attempt, response.headers)
+                print(
+                    f"{method} {url} returned {response.status}, retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+            location = response.headers.get("Location")
+            if (
+                response.status in REDIRECT_STATUSES
+                and location
+                and method in ("GET", "HEAD")
+                and redirects < MAX_REDIRECTS
+            ):
+                return self._request(
+                    method,
+                    urllib.parse.urljoin(url, location),
+                    None,
+                    extra_headers,
+                    stream,
+                    origin=origin,
+                    redirects=redirects + 1,
+                )
+            if response.status >= 400 or response.status in REDIRECT_STATUSES:
+                raise urllib.error.HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.headers,
+                    io.BytesIO(content),
+                )
+            if stream:
+                response.url = url
+                return response, response.headers
+            if method == "GET" and (etag := response.headers.get("ETag")):
+                self._etags[url] = (etag, content)
+            return content, response.headers
+
+        # Not reached, the last attempt either returns or raises
+        raise AssertionError(f"{method} {url}")
+
+    def request_json(self, method: str, url: str, data: Any = None) -> Any:
+        """Like request() but decodes the body as JSON, None if it is empty."""
+        content = self.request(method, url, data)
+        return json.loads(content) if content else None
+
+
+_clients: Dict[Optional[str], ApiClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token: Optional[str] = None) -> ApiClient:
+    """
+    Returns the client shared by everything in this process that uses token
+    (GitHub API) or no token (other hosts, such as TuxSuite's storage).
+    """
+    with _clients_lock:
+        if (client := _clients.get(token)) is None:
+            headers = {"User-Agent": "ClangBuiltLinux-continuous-integration2"}
+            if token is not None:
+                headers.update(
+                    {
+                        "Accept": "application/vnd.github+json",
+                        "Authorization": f"Bearer {token}",
+                        "X-GitHub-Api-Version": "2022-11-28",
+                    }
+                )
+            client = _clients[token] = ApiClient(headers)
+        return client
@@ -0,0 +1,387 @@
+"""
+Storage for the cache entries, which are JSON objects keyed by names like the
+ones that get_workflow_name_to_var_name() returns.
+
+The backend is picked with CACHE_BACKEND:
+
+    github         GitHub Actions Repository Variables (the default)
+    sqlite:<path>  A local SQLite database, for self-hosted setups and testing
+
+The cache semantics (which states can be hit, never going from 'fail' to
+'pass') live in check.py and update_cache_entry() and are the same with every
+backend.
+
+Several kick_tuxsuite jobs of a workflow update its entry at around the same
+time, so entries carry a "version" that is bumped on every update and
+swap_cache_entry() only writes an entry if its version is still the one that
+it read (compare-and-swap), retrying on conflicts. The SQLite backend does
+this atomically. Repository Variables have no conditional writes, so the
+GitHub backend checks the version right before writing and swap_cache_entry()
+then checks that its changes were not overwritten by a job that read the entry
+before they were written.
+"""
+
+import abc
+import contextlib
+import copy
+import json
+import os
+from pathlib import Path
+import random
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+import urllib.error
+
+from variables import RepositoryVariables
+
+
+class CacheEntryExistsError(Exception): ...
+
+
+class CacheEntryNotFoundError(Exception): ...
+
+
+class CacheEntryConflictError(Exception): ...
+
+
+# How many times update_cache_entry() tries to apply its changes
+UPDATE_ATTEMPTS = 8
+# How long update_cache_entry() waits before checking that its changes were not
+# overwritten with a backend that does not swap atomically. It must be longer
+# than it takes another job to read, change, and write the entry.
+SETTLE_TIME = 3
+
+
+class CacheBackend(abc.ABC):
+    # Whether update() with expected_version is an atomic compare-and-swap
+    atomic = False
+
+    @abc.abstractmethod
+    def get(self, key: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Returns the entry for key or None if there is no such entry. With
+        fresh, the entry is never served from a local snapshot.
+        """
+
+    @abc.abstractmethod
+    def create(self, key: str, value: Dict[str, Any]) -> None:
+        """Creates an entry, raising CacheEntryExistsError if it exists."""
+
+    @abc.abstractmethod
+    def update(
+        self, key: str, value: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> None:
+        """
+        Replaces an entry, raising CacheEntryNotFoundError if it does not exist
+        and CacheEntryConflictError if expected_version is given but is not
+        the "version" of the entry (0 if it has none).
+        """
+
+    @abc.abstractmethod
+    def list(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Returns every entry, with None as the value of entries that are not
+        valid JSON so that they can still be deleted.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Deletes an entry, raising CacheEntryNotFoundError if it does not exist."""
+
+
+class GitHubBackend(CacheBackend):
+    def __init__(self, token: str):
+        self.client = RepositoryVariables(token)
+
+    @staticmethod
+    def _translate(key, err):
+        if err.code == 404:
+            return CacheEntryNotFoundError(key)
+        if err.code == 409:
+            return CacheEntryExistsError(key)
+        return err
+
+    def get(self, key, fresh=False):
+        if (value := self.client.get(key, use_snapshot=not fresh)) is None:
+            return None
+        return json.loads(value)
+
+    def create(self, key, value):
+        try:
+            self.client.create(key, json.dumps(value))
+        except urllib.error.HTTPError as err:
+            raise self._translate(key, err) from err
+
+    def update(self, key, value, expected_version=None):
+        if expected_version is not None:
+            # A cheap conditional request if the entry has not changed
+            if (current := self.get(key, fresh=True)) is None:
+                raise CacheEntryNotFoundError(key)
+            if current.get("version", 0) != expected_version:
+                raise CacheEntryConflictError(key)
+        try:
+            self.client.update(key, json.dumps(value))
+        except urllib.error.HTTPError as err:
+            raise self._translate(key, err) from err
+
+    def list(self):
+        entries = {}
+        for key, value in self.client.list().items():
+            try:
+                entries[key] = json.loads(value)
+            except json.JSONDecodeError:
+                entries[key] = None
+        return entries
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except urllib.error.HTTPError as err:
+            raise self._translate(key, err) from err
+
+
+class SQLiteBackend(CacheBackend):
+    atomic = True
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Several jobs may share the database on a self-hosted runner, wait for
+        # the others rather than failing when it is locked.
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            # commits on success and rolls back on errors
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, fresh=False):
+        # There is no local snapshot, every read is fresh
+        del fresh
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def create(self, key, value):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO cache (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value)),
+                )
+        except sqlite3.IntegrityError as err:
+            raise CacheEntryExistsError(key) from err
+
+    def update(self, key, value, expected_version=None):
+        with self._connect() as conn:
+            # Take the write lock before reading so that the version cannot
+            # change between checking it and writing the entry.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                raise CacheEntryNotFoundError(key)
+            if (
+                expected_version is not None
+                and json.loads(row[0]).get("version", 0) != expected_version
+            ):
+                raise CacheEntryConflictError(key)
+            conn.execute(
+                "UPDATE cache SET value = ? WHERE key = ?", (json.dumps(value), key)
+            )
+
+    def list(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, value FROM cache ORDER BY key").fetchall()
+        entries = {}
+        for key, value in rows:
+            try:
+                entries[key] = json.loads(value)
+            except json.JSONDecodeError:
+                entries[key] = None
+        return entries
+
+    def delete(self, key):
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        if cursor.rowcount == 0:
+            raise CacheEntryNotFoundError(key)
+
+
+def get_backend(token: Optional[str] = None) -> CacheBackend:
+    """
+    Returns the backend selected by CACHE_BACKEND. The GitHub backend uses
+    token or REPO_SCOPED_PAT from the environment.
+    """
+    spec = os.environ.get("CACHE_BACKEND", "github")
+    if spec == "github":
+        if token is None:
+            # this REPO_SCOPED_PAT comes from GitHub Actions repository secrets
+            # if we aren't running in a workflow a KeyError is raised and caught by caller
+            # you may manually set this in your environment as well.
+            token = os.environ["REPO_SCOPED_PAT"]
+        return GitHubBackend(token)
+    if spec.startswith("sqlite:"):
+        return SQLiteBackend(Path(spec[len("sqlite:") :]))
+    raise ValueError(
+        f"Unknown CACHE_BACKEND ('{spec}'), expected 'github' or 'sqlite:<path>'"
+    )
+
+
+def get_workflow_status(jobs: Dict[str, str], expected_jobs: Iterable[str] = ()) -> str:
+    """
+    Returns the build_status of a workflow from the statuses of its
+    kick_tuxsuite jobs: the first status that is neither 'pass' nor 'fail'
+    (such as 'badtux') so that the workflow runs again, then 'fail', then
+    'presuite' if one of expected_jobs has not reported yet, and 'pass' only
+    when every job passed.
+    """
+    statuses = [jobs.get(job) for job in expected_jobs] or list(jobs.values())
+    for status in statuses:
+        if status is not None and status not in ("pass", "fail"):
+            return status
+    if "fail" in statuses:
+        return "fail"
+    if None in statuses or not statuses:
+        return "presuite"
+    return "pass"
+
+
+def update_cache_entry(
+    backend: CacheBackend,
+    key: str,
+    *,
+    sha: Optional[str] = None,
+    clang_version: Optional[str] = None,
+    patches_hash: Optional[str] = None,
+    build_status: Optional[str] = None,
+    other: Optional[Dict[str, str]] = None,
+    builds: Optional[Dict[str, list]] = None,
+    job: Optional[str] = None,
+    expected_jobs: Iterable[str] = (),
+    allow_fail_to_pass=False,  # should a cache entry be allowed to go from 'fail' to 'pass'
+):
+    """
+    Update cache entries.
+
+    Only non-None fields are updated, the others remain as they are in the cache.
+
+    Use `other` to provide more values than what is supported as keyword args.
+
+    `builds` is merged into the results of the individual builds, replacing the
+    results of the builds that it has.
+
+    With `job`, `build_status` is the status of that kick_tuxsuite job, which
+    is kept under "jobs", and the build_status of the entry is derived from
+    the statuses of all of the jobs (see get_workflow_status()).
+
+    The changes are applied with swap_cache_entry().
+    """
+    expected_jobs = list(expected_jobs)
+
+    def apply(value):
+        if sha:
+            value["linux_sha"] = sha
+        if clang_version:
+            value["clang_version"] = clang_version
+        if patches_hash:
+            value["patches_hash"] = patches_hash
+        if build_status and job:
+            jobs = value.setdefault("jobs", {})
+            if allow_fail_to_pass or not (
+                jobs.get(job) == "fail" and build_status == "pass"
+            ):
+                jobs[job] = build_status
+            value["build_status"] = get_workflow_status(jobs, expected_jobs)
+        elif build_status:
+            if (
+                not allow_fail_to_pass
+                and value['build_status'] == 'fail'
+                and build_status == 'pass'
+            ):
+                ...
+            else:
+                value["build_status"] = build_status
+        if other and isinstance(other, dict):
+            for k, v in other.items():
+                value[k] = v
+        if builds:
+            value.setdefault("builds", {}).update(builds)
+        return value
+
+    def is_applied(value):
+        # Whether the changes of this job are in value, other jobs may have
+        # changed other fields since.
+        applied = apply(copy.deepcopy(value))
+        return applied.get("jobs", {}).get(job) == value.get("jobs", {}).get(
+            job
+        ) and applied.get("builds") == value.get("builds")
+
+    new_value = swap_cache_entry(backend, key, apply, is_applied if job else None)
+    print(f"""\
+            Updated cache entry with fields:
+            {build_status=}
+            {job=}
+            {sha=}
+            {clang_version=}
+            {patches_hash=}
+            {new_value['build_status']=}
+        """)
+
+
+def swap_cache_entry(
+    backend: CacheBackend,
+    key: str,
+    apply: Callable[[Dict[str, Any]], Dict[str, Any]],
+    is_applied: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    Replaces the entry for key with what apply() returns for a copy of it,
+    with a compare-and-swap on the version of the entry, retrying with the
+    latest entry when another job got there first. With a backend that does
+    not swap atomically, is_applied() is used to check that the changes were
+    not overwritten by a job that read the entry before they were written.
+
+    Returns the new entry.
+    """
+    for attempt in range(UPDATE_ATTEMPTS):
+        if (cached_value := backend.get(key, fresh=True)) is None:
+            raise CacheEntryNotFoundError(key)
+        print(f"{cached_value=}")
+        version = cached_value.get("version", 0)
+        new_value = apply(copy.deepcopy(cached_value))
+        new_value["version"] = version + 1
+
+        try:
+            backend.update(key, new_value, expected_version=version)
+        except CacheEntryConflictError:
+            delay = random.uniform(0, min(SETTLE_TIME, 0.25 * 2**attempt))
+            print(f"{key} was changed by another job, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+
+        if not backend.atomic and is_applied is not None:
+            # A job that read the entry before this write may still write its
+            # changes on top of an older version, make sure that these survived.
+            time.sleep(SETTLE_TIME * random.uniform(1, 1.5))
+            if not is_applied(backend.get(key, fresh=True) or {}):
+                print(f"The changes to {key} were overwritten by another job, retrying")
+                continue
+
+        return new_value
+
+    raise CacheEntryConflictError(
+        f"Could not update {key} after {UPDATE_ATTEMPTS} attempts"
+    )
@@ -3,7 +3,6 @@
 # requires-python = ">=3.9"
 # dependencies = [
 #     "pyyaml>=6.0.3",
-#     "requests>=2.32.5",
 # ]
 # ///
 """
@@ -35,37 +34,47 @@ to signify that it has yet to be built by Tuxsuite. Upon completion of Tuxsuite,
 a new build_status is assigned to the cache entry by check_logs.py. Importantly,
 we want to only cache on a "pass" or "fail" status as these mean that Tuxsuite
 actually completed its work and didnt timeout.
+
+The cache entry also records the result of every build in the workflow under
+"builds", keyed by get_build_cache_key(). When the workflow has to run again
+with the same linux_sha, clang_version, and patches (because one of its builds
+was not pass or fail), the builds that already have a pass or fail result are
+settled: they are passed to the rest of the workflow through SETTLED_BUILDS so
+that the kick_tuxsuite jobs leave them out of the TuxSuite plan (see dedup.py)
+and check-logs.py does not check them again.
+
+Every check emits a record of its result and how long it took (see
+metrics.py), from which the hit rate of the cache can be reported.
 """
 
 import argparse
 import json
 import os
-import re
 import subprocess
 import sys
+import time
 from typing import Optional
+import urllib.error
 
-# uv will ensure this is available
-# pylint: disable-next=import-error
-import requests
-
-from utils import (
-    get_patches_hash,
-    get_workflow_name_to_var_name,
-    update_repository_variable,
+from backend import (
+    CacheEntryExistsError,
+    get_backend,
+    update_cache_entry,
 )
+from metrics import get_changed_fields, get_miss_result, record_check
+from prune import delete_entries
+from refs import resolve_refs
+from toolchains import get_toolchain_version
+from utils import get_patches_hash, get_workflow_name_to_var_name
 
-OWNER = "ClangBuiltLinux"
-REPO = "continuous-integration2"
 MAIN_BRANCH = "main"
-headers = {}  # populated after args are parsed
+backend = None  # populated after args are parsed
 
 # states we allow our cache system to perform a cache-hit upon
 # other states like 'presuite' or 'unknown' or '' (empty) are considered
 # poisoned and untrustworthy so we should launch the builds.
 # check_logs.py is responsible for populating the build_status field of the cache
 CACHE_HITABLE_STATES = ("pass", "fail")
-TIMEOUT = 64
 
 
 class MalformedCacheError(Exception): ...
@@ -78,52 +87,39 @@ def parse_args():
     parser.add_argument("-w", "--workflow-name", required=True, type=str)
     parser.add_argument("-o", "--git-repo", required=True, type=str)  # url
     parser.add_argument("-r", "--git-ref", required=True, type=str)
+    # the refs of the other trees in the repository, separated by commas
+    parser.add_argument("--git-refs", default="", type=str)
+    # tuxmake toolchain image, like docker.io/tuxmake/x86_64_korg-clang-18:latest
+    # (see toolchains.py). Without it, the version of the clang in PATH is used.
+    parser.add_argument("-t", "--toolchain-image", required=False, type=str)
     parser.add_argument("--purge-cache", required=False, action="store_true")
 
     return parser.parse_args()
 
 
-def get_sha_from_git_ref(git_repo: str, git_ref: str):
-    res = subprocess.run(
-        ["git", "ls-remote", git_repo, "--git-ref", git_ref],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    pattern = r"^[0-9a-z]*"
+def get_sha_from_git_ref(git_repo: str, git_ref: str, other_refs=()):
+    # Resolve the refs of every tree in git_repo at once (which the generator
+    # passes as other_refs) so that the workflows of the other trees (and the
+    # other LLVM versions of this one) can use the result from the cache rather
+    # than asking the server again.
+    git_refs = {git_ref, *other_refs}
 
-    if (match := re.search(r"^[0-9a-z]*", res.stdout)) is None:
-        print(
-            f"Could not get git sha from tree {git_repo} at ref {git_ref}.\n"
-            f"Subprocess returned: {res.stdout}\n"
-            f"Which doesn't have any matches with this pattern: {pattern}\n"
-            f"Expecting something like this: be59bee58790f9d137cfc11973e856e4f8ab3888	refs/tags/v6.7-rc5"
-        )
+    if (sha := resolve_refs(git_repo, git_refs, backend).get(git_ref)) is None:
+        print(f"Could not get git sha from tree {git_repo} at ref {git_ref}.")
         sys.exit(1)
 
-    return match.group()
+    return sha
 
 
 def ___purge___cache___():
     """!!!completely clears the CBL CI cache!!!"""
-    list_url = f"https://api.github.com/repos/{OWNER}/{REPO}/actions/variables"
-
-    list_response = requests.get(list_url, headers=headers, timeout=TIMEOUT)
-    print(list_response.content)
-    all_variables_keys = [
-        x["name"]
-        for x in json.loads(list_response.content)["variables"]
-        if x["name"].startswith("_")
-    ]
-
-    for key in all_variables_keys:
-        delete_url = (
-            f"https://api.github.com/repos/{OWNER}/{REPO}/actions/variables/{key}"
-        )
-        delete_response = requests.delete(delete_url, headers=headers, timeout=TIMEOUT)
-        if delete_response.status_code != 204:
-            print(f"ERROR: Couldn't delete cache entry with key {key}")
-            sys.exit(1)
+    all_variables_keys = list(backend.list())
+    print(f"Deleting {len(all_variables_keys)} cache entries: {all_variables_keys}")
+
+    if failures := delete_entries(backend, all_variables_keys):
+        for key, err in failures.items():
+            print(f"ERROR: Couldn't delete cache entry with key {key}: {err}")
+        sys.exit(1)
 
     print("CACHE CLEARED")
 
@@ -132,9 +128,10 @@ def get_clang_version():
     """
     Get the current clang version info string.
 
-    When check_cache.py is run by a Github workflow we are in a container
-    using the specific toolchain version that Tuxmake plans to use in its
-    upcoming build(s).
+    This is only correct when check_cache.py is run in a container using the
+    specific toolchain version that Tuxmake plans to use in its upcoming
+    build(s). Workflows pass --toolchain-image instead, so that the version is
+    looked up without the container (see toolchains.py).
     """
     res = subprocess.run(
         ["clang", "--version"],
@@ -147,55 +144,107 @@ def get_clang_version():
 
 
 def get_repository_variable_or_none(name: str) -> Optional[dict]:
-    _url = f"https://api.github.com/repos/{OWNER}/{REPO}/actions/variables/{name}"
-
-    response = requests.get(_url, headers=headers, timeout=TIMEOUT)
-    if response.status_code != 200:
+    try:
+        return backend.get(name)
+    except urllib.error.URLError:
         return None
 
-    as_dict = json.loads(response.content.decode())
-    return json.loads(as_dict["value"])
-
 
 def create_repository_variable(
     name: str, linux_sha: str, clang_version: str, patches_hash: str
 ) -> None:
-    _url = f"https://api.github.com/repos/{OWNER}/{REPO}/actions/variables"
-
-    _value = json.dumps(
-        {
-            "linux_sha": linux_sha,
-            "clang_version": clang_version,
-            "patches_hash": patches_hash,
-            "build_status": "presuite",
-        }
-    )
-    data = {"name": name, "value": _value}
+    _value = {
+        "linux_sha": linux_sha,
+        "clang_version": clang_version,
+        "patches_hash": patches_hash,
+        "build_status": "presuite",
+        "builds": {},
+        "jobs": {},
+    }
+
+    try:
+        backend.create(name, _value)
+    except (CacheEntryExistsError, urllib.error.HTTPError) as err:
+        print(f"create_repository_variable() failed: {err}")
+    else:
+        print(f"create_repository_variable() created {name}: {_value}")
+
+
+def get_settled_builds(entry: dict) -> dict:
+    """
+    Returns the keys and results of the builds in a cache entry whose results
+    can be reused as is.
+    """
+    return {
+        key: build_result[0]
+        for key, build_result in entry.get("builds", {}).items()
+        if build_result[0] in CACHE_HITABLE_STATES
+    }
 
-    resp = requests.post(_url, headers=headers, json=data, timeout=TIMEOUT)
-    print(f"create_repository_variable() response:\n{resp.content}")
+
+def record_result(
+    workflow_name: str, start_time: float, inputs: dict, check_result: str, **fields
+) -> None:
+    """
+    Records the result of the check of workflow_name, which started at
+    start_time (from time.monotonic()), for the current inputs of its entry.
+    """
+    record_check(
+        workflow_name, check_result, time.monotonic() - start_time, **inputs, **fields
+    )
 
 
 if __name__ == "__main__":
+    START_TIME = time.monotonic()
     args = parse_args()
 
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {args.github_token}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
+    backend = get_backend(args.github_token)
 
     if args.purge_cache:
         ___purge___cache___()
         sys.exit(1)
 
+    # With CACHE_SNAPSHOT, the lookups of this job and the kick_tuxsuite jobs
+    # after it are served from a single listing of the cache (see variables.py).
+    # Listing takes a request per page, so without a snapshot to reuse, every
+    # lookup is a single request for that entry instead.
+    if os.getenv("CACHE_SNAPSHOT"):
+        try:
+            backend.list()
+        except urllib.error.URLError as err:
+            print(f"Could not take a snapshot of the cache: {err}")
+
     VAR_NAME = get_workflow_name_to_var_name(args.workflow_name)
     tree_name = args.workflow_name.split(' ', 1)[0]
 
-    curr_sha = get_sha_from_git_ref(args.git_repo, args.git_ref)
-    curr_clang_version = get_clang_version()
+    curr_sha = get_sha_from_git_ref(
+        args.git_repo, args.git_ref, filter(None, args.git_refs.split(","))
+    )
+    if args.toolchain_image:
+        curr_clang_version, toolchain_image = get_toolchain_version(
+            backend, args.toolchain_image
+        )
+    else:
+        curr_clang_version, toolchain_image = get_clang_version(), None
     # pylint: disable-next=invalid-name
     curr_patches_hash = get_patches_hash(tree_name)
+    # The kick_tuxsuite jobs need these to reuse the results of identical
+    # builds in other workflows (see dedup.py)
+    env_file = os.getenv("GITHUB_ENV", None)
+    if env_file is not None:
+        with open(env_file, "a", encoding="utf-8") as fd:
+            fd.write(f"LINUX_SHA={curr_sha}\n")
+            fd.write(f"CLANG_VERSION={curr_clang_version}\n")
+            # update.py records the version of this image for the next time
+            if toolchain_image is not None:
+                fd.write(f"TOOLCHAIN_IMAGE={toolchain_image}\n")
+
+    curr_inputs = {
+        "linux_sha": curr_sha,
+        "clang_version": curr_clang_version,
+        "patches_hash": curr_patches_hash,
+    }
+
     print(f"""\
         Current sha: {curr_sha}
         Current Clang Version: {curr_clang_version}
@@ -215,6 +264,7 @@ if __name__ == "__main__":
             clang_version=curr_clang_version,
             patches_hash=curr_patches_hash,
         )
+        record_result(args.workflow_name, START_TIME, curr_inputs, "miss-new")
         sys.exit(1)
 
     # excess fields are OK but these fields are mandatory for caching.
@@ -235,11 +285,12 @@ if __name__ == "__main__":
     cached_build_status = result["build_status"]
     cached_patches_hash = result.get("patches_hash", curr_patches_hash)
 
-    if (
-        cached_sha != curr_sha
-        or cached_clang_version != curr_clang_version
-        or cached_patches_hash != curr_patches_hash
-    ):
+    cached_inputs = {
+        "linux_sha": cached_sha,
+        "clang_version": cached_clang_version,
+        "patches_hash": cached_patches_hash,
+    }
+    if (miss_result := get_miss_result(cached_inputs, curr_inputs)) is not None:
         print(f"""\
             CACHE MISS: current linux_sha is {curr_sha}, clang_version is {curr_clang_version},
             and current patches_hash is {curr_patches_hash} while {args.workflow_name} has
@@ -249,26 +300,49 @@ if __name__ == "__main__":
             Repository Variable key: {VAR_NAME}
             Updating cache now.
         """)
-        update_repository_variable(
+        update_cache_entry(
+            backend,
             VAR_NAME,
-            http_headers=headers,
             sha=curr_sha,
             clang_version=curr_clang_version,
             patches_hash=curr_patches_hash,
             build_status="presuite",
+            # the results of the builds and jobs are for the previous versions
+            other={"builds": {}, "jobs": {}},
+        )
+        record_result(
+            args.workflow_name,
+            START_TIME,
+            curr_inputs,
+            miss_result,
+            changed=get_changed_fields(cached_inputs, curr_inputs),
         )
         sys.exit(1)
 
     # we cache hit, but we only want to allow certain states to be cacheable
     # other states are dodgy and we're better off rerunning the builds just in case
     if (stripped := cached_build_status.strip()) not in CACHE_HITABLE_STATES:
+        settled = get_settled_builds(result)
         print(f"""\
             CACHE HIT: Both the linux_sha and the clang_version match
             However, the previous build status ({stripped}) is not a status
             that check_cache.py is configured to support. The status should be
             one of {CACHE_HITABLE_STATES}.
-            Running the Tuxsuite builds now.
+            Running the Tuxsuite builds that are not settled now ({len(settled)} are).
         """)
+        if env_file is not None:
+            with open(env_file, "a", encoding="utf-8") as fd:
+                fd.write(
+                    f"SETTLED_BUILDS={json.dumps(settled, separators=(',', ':'))}\n"
+                )
+        record_result(
+            args.workflow_name,
+            START_TIME,
+            curr_inputs,
+            "poisoned-state",
+            build_status=stripped,
+            settled=len(settled),
+        )
         sys.exit(1)
 
     print(f"""\
@@ -279,9 +353,14 @@ if __name__ == "__main__":
         CACHED STATUS: {cached_build_status}
     """)
 
-    env_file = os.getenv("GITHUB_ENV", None)
     if env_file is not None:
         with open(env_file, "a", encoding="utf-8") as fd:
-            fd.write(f"CACHE_PASS={cached_build_status.strip()}")
+            fd.write(f"CACHE_PASS={cached_build_status.strip()}\n")
 
+    record_result(
+        args.workflow_name,
+        START_TIME,
+        curr_inputs,
+        f"hit-{cached_build_status.strip()}",
+    )
     sys.exit(0)  # signifies to the workflow that no jobs should run ('success')
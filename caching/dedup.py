@@ -0,0 +1,333 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.8"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+"""
+Run within a kick_tuxsuite_foo job.
+
+Several trees are often at the same commit (for example, stable and an LTS
+branch around a release or mainline and -next right after a merge window) and
+identical builds get done in more than one workflow. Each build is given an
+identity from everything that determines its result: the Linux sha, the
+patches applied on top, the exact clang version, and the TuxSuite build
+specification (target_arch, toolchain, kconfig, targets, kernel_image, and
+make_variables).
+
+'filter' is run before 'tuxsuite plan'. It looks up the identities of the
+builds in a TuxSuite job in the results store and writes a copy of the plan
+with only the builds that have not been done yet, saving the builds.json
+entries of the ones that have to reused.json.
+
+'merge' is run after 'tuxsuite plan'. It adds the reused builds to builds.json
+so that the rest of the workflow cannot tell them apart from builds that were
+just done and records the builds that TuxSuite just completed in the results
+store.
+
+The results store is a fixed set of BUILDS_SLOTS Repository Variables, so that
+it does not grow with every Linux sha that is built. Each Linux sha goes into
+one of them, where its identities map to TuxSuite download URLs, from which the
+full builds.json entry (status.json) can be fetched. When a slot is full, the
+results of the Linux shas that were recorded the longest ago are dropped, as
+the trees have most likely moved on from them. Both commands fall back to doing
+every build if looking up or recording results goes wrong, as reusing results
+is only an optimization.
+
+'filter' also leaves out the builds that check_cache found to have already
+passed or failed with the same inputs in this workflow (SETTLED_BUILDS), so
+that rerunning a workflow only does the builds that did not finish.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+# uv will ensure this is available
+# pylint: disable-next=import-error
+import yaml
+
+from api import get_client
+from backend import CacheEntryConflictError, CacheEntryExistsError, get_backend
+from utils import get_build_cache_key, get_patches_hash, normalize_make_variables
+
+# GitHub limits the size of a Repository Variable to 48 KB
+MAX_VARIABLE_SIZE = 48 * 1024
+# The builds that TuxSuite completed and whose result can be reused
+REUSABLE_STATES = ("pass", "fail")
+# Concurrent kick jobs may be updating the same variable, retry lost updates
+RECORD_ATTEMPTS = 3
+# The slots of the results store are named this followed by their number
+BUILDS_PREFIX = "_BUILDS_"
+# How many Repository Variables the results store uses. There are rarely more
+# than a few dozen distinct Linux shas being built at a time.
+BUILDS_SLOTS = 32
+
+REUSED_JSON = Path("reused.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Reuse the results of identical builds across workflows."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    filter_parser = subparsers.add_parser(
+        "filter", help="Remove builds that have already been done from a TuxSuite job"
+    )
+    filter_parser.add_argument(
+        "-j", "--job-name", required=True, help="Name of the TuxSuite job"
+    )
+    filter_parser.add_argument(
+        "-t", "--tuxsuite-yml", required=True, type=Path, help="TuxSuite plan"
+    )
+    filter_parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=Path,
+        help="Where to write the filtered plan",
+    )
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Add reused builds to builds.json and record new builds"
+    )
+    merge_parser.add_argument(
+        "-b", "--builds-json", default=Path("builds.json"), type=Path
+    )
+
+    return parser.parse_args()
+
+
+def get_build_identity(sha, patches_hash, clang_version, build):
+    """
+    Returns the identity of a build from a TuxSuite plan or builds.json, which
+    both use the same keys for the build specification.
+    """
+    kconfig = build["kconfig"]
+    spec = {
+        "sha": sha,
+        "patches_hash": patches_hash,
+        "clang_version": clang_version,
+        "target_arch": build["target_arch"],
+        "toolchain": build["toolchain"],
+        "kconfig": [kconfig] if isinstance(kconfig, str) else list(kconfig),
+        "targets": list(build.get("targets") or []),
+        "kernel_image": build.get("kernel_image") or "",
+        "make_variables": normalize_make_variables(build.get("make_variables")),
+    }
+    text = json.dumps(spec, sort_keys=True)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_variable_name(sha):
+    return f"{BUILDS_PREFIX}{int(sha[:8], 16) % BUILDS_SLOTS:02d}"
+
+
+def get_variable_names():
+    return {f"{BUILDS_PREFIX}{slot:02d}" for slot in range(BUILDS_SLOTS)}
+
+
+def get_results(sha):
+    entry = get_backend().get(get_variable_name(sha)) or {}
+    return entry.get("shas", {}).get(sha, {})
+
+
+def trim_results(shas):
+    """
+    Drops the results of the Linux shas that were recorded the longest ago
+    (and then the oldest results of the only one left) until the slot fits
+    into a Repository Variable.
+    """
+    while shas and len(json.dumps(shas)) > MAX_VARIABLE_SIZE:
+        oldest = next(iter(shas))
+        if len(shas) > 1 or len(shas[oldest]) <= 1:
+            del shas[oldest]
+        else:
+            del shas[oldest][next(iter(shas[oldest]))]
+
+
+def put_results(var_name, new_results):
+    """
+    Adds new_results ({sha: {identity: download_url}}) to a slot with a
+    compare-and-swap on its version, retrying when another job changed it in
+    the meantime. The Linux shas in new_results become the most recent ones.
+    """
+    backend = get_backend()
+    for _ in range(RECORD_ATTEMPTS):
+        if (entry := backend.get(var_name, fresh=True)) is None:
+            shas = dict(new_results)
+            trim_results(shas)
+            try:
+                backend.create(var_name, {"version": 1, "shas": shas})
+            except CacheEntryExistsError:
+                continue
+            return
+
+        shas = entry.get("shas", {})
+        if all(
+            results.items() <= shas.get(sha, {}).items()
+            for sha, results in new_results.items()
+        ):
+            return
+        for sha, results in new_results.items():
+            shas[sha] = {**shas.pop(sha, {}), **results}
+        trim_results(shas)
+        version = entry.get("version", 0)
+        try:
+            backend.update(
+                var_name,
+                {"version": version + 1, "shas": shas},
+                expected_version=version,
+            )
+        except CacheEntryConflictError:
+            continue
+        return
+    print(f"Could not record builds in {var_name} after {RECORD_ATTEMPTS} attempts")
+
+
+def fetch_build(download_url):
+    return get_client().request_json("GET", download_url + "status.json")
+
+
+def get_tree_name():
+    return os.environ["GITHUB_WORKFLOW"].split(" ", 1)[0]
+
+
+def filter_job(job_name, tuxsuite_yml, output):
+    plan = yaml.safe_load(tuxsuite_yml.read_text(encoding="utf-8"))
+    plan["jobs"] = [job for job in plan["jobs"] if job["name"] == job_name]
+    if not plan["jobs"]:
+        print(f"No job named '{job_name}' in {tuxsuite_yml}?")
+        sys.exit(1)
+    job = plan["jobs"][0]
+
+    # The results of the builds of this job that are left out because they
+    # are settled, which update.py takes into account for the job's status
+    settled = {}
+    if os.environ.get("GITHUB_EVENT_NAME") != "workflow_dispatch":
+        all_settled = json.loads(os.environ.get("SETTLED_BUILDS") or "{}")
+        remaining = []
+        for build in job["builds"]:
+            key = get_build_cache_key(
+                build["target_arch"], build["kconfig"], build.get("make_variables")
+            )
+            if key in all_settled:
+                settled[key] = all_settled[key]
+            else:
+                remaining.append(build)
+        if settled:
+            print(
+                f"Skipping {len(settled)} builds that already passed or failed with the same inputs"
+            )
+        job["builds"] = remaining
+
+    reused = {}
+    sha = os.environ.get("LINUX_SHA")
+    clang_version = os.environ.get("CLANG_VERSION")
+    if os.environ.get("GITHUB_EVENT_NAME") == "workflow_dispatch":
+        print("Workflow was manually dispatched, doing every build")
+    elif not sha or not clang_version:
+        print("No Linux sha or clang version from check_cache, doing every build")
+    else:
+        try:
+            results = get_results(sha) or {}
+        # pylint: disable-next=broad-exception-caught
+        except Exception as err:
+            print(f"Could not look up previous results ({err}), doing every build")
+            results = {}
+
+        patches_hash = get_patches_hash(get_tree_name())
+        remaining = []
+        for build in job["builds"]:
+            identity = get_build_identity(sha, patches_hash, clang_version, build)
+            if (download_url := results.get(identity)) is not None:
+                try:
+                    entry = fetch_build(download_url)
+                # pylint: disable-next=broad-exception-caught
+                except Exception as err:
+                    print(
+                        f"Could not fetch {download_url}status.json ({err}), rebuilding"
+                    )
+                else:
+                    if entry.get("git_sha") == sha:
+                        print(
+                            f"Reusing {download_url} for {build['target_arch']} {build['kconfig']}"
+                        )
+                        reused[entry.get("uid", identity)] = entry
+                        continue
+            remaining.append(build)
+        job["builds"] = remaining
+
+    print(
+        f"Reusing {len(reused)} builds, submitting {len(job['builds'])} builds to TuxSuite"
+    )
+    REUSED_JSON.write_text(
+        json.dumps(
+            {"builds": reused, "settled": settled, "remaining": len(job["builds"])}
+        ),
+        encoding="utf-8",
+    )
+    output.write_text(yaml.safe_dump(plan, sort_keys=False), encoding="utf-8")
+
+
+def record_builds(builds):
+    patches_hash = get_patches_hash(get_tree_name())
+    new_results = {}
+    for build in builds.values():
+        if (
+            build.get("tuxbuild_status") != "complete"
+            or build.get("build_status") not in REUSABLE_STATES
+        ):
+            continue
+        try:
+            sha = build["git_sha"]
+            clang_version = build["tuxmake_metadata"]["compiler"]["version_full"]
+        except KeyError:
+            continue
+        identity = get_build_identity(sha, patches_hash, clang_version, build)
+        new_results.setdefault(sha, {})[identity] = build["download_url"]
+
+    by_slot = {}
+    for sha, entries in new_results.items():
+        by_slot.setdefault(get_variable_name(sha), {})[sha] = entries
+    for var_name, slot_results in by_slot.items():
+        put_results(var_name, slot_results)
+        for sha, entries in slot_results.items():
+            print(f"Recorded {len(entries)} builds for {sha} in {var_name}")
+
+
+def merge(builds_json):
+    if builds_json.exists():
+        builds = json.loads(builds_json.read_text(encoding="utf-8"))
+    else:
+        # Every build was reused (or 'tuxsuite plan' failed outright)
+        builds = {"builds": {}}
+
+    try:
+        record_builds(builds["builds"])
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        print(f"Could not record results of builds for reuse: {err}")
+
+    if REUSED_JSON.exists():
+        reused = json.loads(REUSED_JSON.read_text(encoding="utf-8"))["builds"]
+        builds["builds"].update(reused)
+        print(f"Added {len(reused)} reused builds to {builds_json}")
+
+    # Always write builds.json, even when every build was settled, as the rest
+    # of the workflow expects it.
+    builds_json.write_text(json.dumps(builds), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "filter":
+        filter_job(args.job_name, args.tuxsuite_yml, args.output)
+    else:
+        merge(args.builds_json)
@@ -0,0 +1,413 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+"""
+Measure how effective the frontend cache is.
+
+Every run of check.py emits one record of what it decided:
+
+    {"time": ..., "workflow": "mainline (clang-18)", "tree": "mainline",
+     "llvm_version": "18", "result": "hit-pass", "latency": 1.234, ...}
+
+where result is one of RESULTS:
+
+    hit-pass, hit-fail  The workflow was skipped with the cached status
+    miss-new            There was no cache entry for the workflow
+    miss-sha            The Linux sha changed
+    miss-clang          The clang version changed
+    miss-patches        The patches changed
+    poisoned-state      The inputs matched but the cached status was not one
+                        that can be hit (such as 'presuite' or 'badtux')
+
+A miss with several changed inputs is reported as the first of sha, clang,
+and patches that changed, all of them are listed in "changed".
+
+The record is always printed to the job log on a line starting with
+RECORD_MARKER and is also appended to the log selected by CACHE_METRICS, if it
+is set:
+
+    jsonl:<path>   One JSON record per line
+    sqlite:<path>  A 'checks' table in a SQLite database
+
+'report' aggregates records from any number of such logs (plain paths are read
+like JSONL files, which includes downloaded job logs, as only the lines with a
+record are used) into the hit rate per tree and LLVM version and an estimate
+of the build minutes that the hits saved, from the builds of the TuxSuite jobs
+of each workflow and the build duration model of the generator:
+
+    $ caching/metrics.py report sqlite:metrics.db --since 7
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import statistics
+import sys
+import time
+import types
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# uv will ensure this is available
+# pylint: disable-next=import-error
+import yaml
+
+from utils import (
+    CI_ROOT,
+    estimate_build_duration,
+    get_config_kind,
+    load_build_durations,
+)
+
+RESULTS = (
+    "hit-pass",
+    "hit-fail",
+    "miss-new",
+    "miss-sha",
+    "miss-clang",
+    "miss-patches",
+    "poisoned-state",
+)
+HIT_RESULTS = ("hit-pass", "hit-fail")
+# The inputs of a cache entry, in the order that misses are attributed to them
+MISS_FIELDS = (
+    ("miss-sha", "linux_sha"),
+    ("miss-clang", "clang_version"),
+    ("miss-patches", "patches_hash"),
+)
+# Prefix of the line with the record in the job log
+RECORD_MARKER = "CACHE_METRIC "
+# Columns of the SQLite log, the whole record is kept in 'record'
+SQLITE_COLUMNS = ("time", "workflow", "tree", "llvm_version", "result", "latency")
+# libyaml's loader is much faster for the large generated files, if PyYAML was
+# built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def parse_workflow_name(workflow_name: str):
+    """
+    Returns the tree and LLVM version of a workflow name like
+    'mainline (clang-18)' or 'next (clang-19) [1/2]'.
+    """
+    if (match := re.match(r"(\S+) \(clang-([^)]+)\)", workflow_name)) is None:
+        return workflow_name, None
+    return match.group(1), match.group(2)
+
+
+def get_miss_result(cached: Dict[str, Any], current: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the result of a check whose cache entry is cached and whose inputs
+    are current, both with the keys of MISS_FIELDS, if it is a miss.
+    """
+    for result, field in MISS_FIELDS:
+        if cached.get(field) != current.get(field):
+            return result
+    return None
+
+
+def get_changed_fields(cached: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    return [
+        field for _, field in MISS_FIELDS if cached.get(field) != current.get(field)
+    ]
+
+
+def make_record(
+    workflow_name: str, result: str, latency: float, **fields
+) -> Dict[str, Any]:
+    if result not in RESULTS:
+        raise ValueError(f"Unknown result '{result}', expected one of {RESULTS}")
+    tree, llvm_version = parse_workflow_name(workflow_name)
+    record = {
+        "time": round(time.time(), 3),
+        "workflow": workflow_name,
+        "tree": tree,
+        "llvm_version": llvm_version,
+        "result": result,
+        "latency": round(latency, 3),
+    }
+    for name in ("GITHUB_RUN_ID", "GITHUB_RUN_ATTEMPT", "GITHUB_EVENT_NAME"):
+        if (value := os.environ.get(name)) is not None:
+            record[name[len("GITHUB_") :].lower()] = value
+    record.update(fields)
+    return record
+
+
+class JSONLMetricsLog:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        # A single write of a line is atomic with O_APPEND, so concurrent jobs
+        # sharing the file do not interleave their records.
+        with self.path.open("a", encoding="utf-8") as file:
+            file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        with self.path.open(encoding="utf-8", errors="replace") as file:
+            for line in file:
+                if RECORD_MARKER in line:
+                    text = line.split(RECORD_MARKER, 1)[1]
+                elif line.startswith("{"):
+                    text = line
+                else:
+                    continue
+                try:
+                    record = json.loads(text)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and record.get("result") in RESULTS:
+                    yield record
+
+
+class SQLiteMetricsLog:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checks ("
+                "time REAL, workflow TEXT, tree TEXT, llvm_version TEXT, "
+                "result TEXT, latency REAL, record TEXT NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            # commits on success and rolls back on errors
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append(self, record: Dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO checks ({', '.join(SQLITE_COLUMNS)}, record) "
+                f"VALUES ({', '.join('?' * (len(SQLITE_COLUMNS) + 1))})",
+                (
+                    *(record.get(column) for column in SQLITE_COLUMNS),
+                    json.dumps(record),
+                ),
+            )
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT record FROM checks ORDER BY time").fetchall()
+        for (record,) in rows:
+            yield json.loads(record)
+
+
+def get_metrics_log(spec: str):
+    """
+    Returns the log for a spec like the ones of CACHE_METRICS, with plain
+    paths being read like JSONL files.
+    """
+    if spec.startswith("sqlite:"):
+        return SQLiteMetricsLog(Path(spec[len("sqlite:") :]))
+    if spec.startswith("jsonl:"):
+        return JSONLMetricsLog(Path(spec[len("jsonl:") :]))
+    return JSONLMetricsLog(Path(spec))
+
+
+def record_check(
+    workflow_name: str, result: str, latency: float, **fields
+) -> Dict[str, Any]:
+    """
+    Prints the record of a check and appends it to the log in CACHE_METRICS,
+    if any. Failing to record it is not fatal, it is only an observation.
+    """
+    record = make_record(workflow_name, result, latency, **fields)
+    print(f"{RECORD_MARKER}{json.dumps(record, separators=(',', ':'))}")
+    if spec := os.environ.get("CACHE_METRICS"):
+        try:
+            get_metrics_log(spec).append(record)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as err:
+            print(f"Could not append the record to {spec} ({err})")
+    return record
+
+
+def estimate_plan_build(build: Dict[str, Any], durations) -> float:
+    """
+    Estimate how many seconds a build from a TuxSuite plan takes with
+    utils.estimate_build_duration(), which only needs the architecture and
+    kind of configuration of a Build when the toolchain is given.
+    """
+    plan_build = types.SimpleNamespace(
+        arch=build["target_arch"], kind=get_config_kind(build["kconfig"])
+    )
+    return estimate_build_duration(plan_build, durations, build["toolchain"])
+
+
+def get_workflow_costs(
+    root: Path = CI_ROOT, durations=None
+) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the number of builds and their estimated build minutes for every
+    generated workflow, keyed by the workflow name, from the TuxSuite jobs that
+    the workflow kicks off (its CACHE_JOB values) in its TuxSuite plan.
+    """
+    plans = {}
+    costs = {}
+    for workflow_yml in sorted(
+        Path(root, ".github", "workflows").glob("*-clang-*.yml")
+    ):
+        workflow = yaml.load(
+            workflow_yml.read_text(encoding="utf-8"), Loader=YAML_LOADER
+        )
+        tree, llvm_version = parse_workflow_name(workflow["name"])
+        tuxsuite_yml = Path(root, "tuxsuite", f"{tree}-clang-{llvm_version}.tux.yml")
+        if tuxsuite_yml not in plans:
+            if not tuxsuite_yml.exists():
+                continue
+            plan = yaml.load(
+                tuxsuite_yml.read_text(encoding="utf-8"), Loader=YAML_LOADER
+            )
+            plans[tuxsuite_yml] = {job["name"]: job["builds"] for job in plan["jobs"]}
+        job_names = {
+            job.get("env", {}).get("CACHE_JOB") for job in workflow["jobs"].values()
+        } - {None}
+        builds = [
+            build for name in job_names for build in plans[tuxsuite_yml].get(name, [])
+        ]
+        costs[workflow["name"]] = {
+            "builds": len(builds),
+            "minutes": sum(estimate_plan_build(build, durations) for build in builds)
+            / 60,
+        }
+    return costs
+
+
+def read_records(
+    specs: Iterable[str], start: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    records = []
+    for spec in specs:
+        for record in get_metrics_log(spec).read():
+            if start is None or record.get("time", 0) >= start:
+                records.append(record)
+    return records
+
+
+def get_report(records: Iterable[Dict[str, Any]], costs: Dict[str, Dict[str, float]]):
+    """
+    Returns the aggregated records per (tree, LLVM version), sorted by the
+    build minutes that they saved.
+    """
+    groups = collections.defaultdict(
+        lambda: {
+            "results": collections.Counter(),
+            "latencies": [],
+            "builds": 0,
+            "minutes": 0.0,
+        }
+    )
+    for record in records:
+        group = groups[(record.get("tree"), str(record.get("llvm_version")))]
+        group["results"][record["result"]] += 1
+        group["latencies"].append(record.get("latency", 0))
+        if record["result"] in HIT_RESULTS and (
+            cost := costs.get(record.get("workflow"))
+        ):
+            group["builds"] += cost["builds"]
+            group["minutes"] += cost["minutes"]
+
+    rows = []
+    for (tree, llvm_version), group in groups.items():
+        checks = sum(group["results"].values())
+        hits = sum(group["results"][result] for result in HIT_RESULTS)
+        rows.append(
+            {
+                "tree": tree,
+                "llvm_version": llvm_version,
+                "checks": checks,
+                "hits": hits,
+                "hit_rate": hits / checks,
+                "results": dict(group["results"]),
+                "median_latency": statistics.median(group["latencies"]),
+                "builds_saved": group["builds"],
+                "minutes_saved": group["minutes"],
+            }
+        )
+    return sorted(
+        rows, key=lambda row: (-row["minutes_saved"], row["tree"], row["llvm_version"])
+    )
+
+
+def print_report(rows):
+    header = f"{'tree':<24} {'llvm':>5} {'checks':>7} {'hits':>6} {'rate':>6} {'latency':>8} {'builds':>8} {'minutes':>9}  misses"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        misses = ", ".join(
+            f"{result}={count}"
+            for result, count in sorted(row["results"].items())
+            if result not in HIT_RESULTS
+        )
+        print(
+            f"{row['tree']:<24} {row['llvm_version']:>5} {row['checks']:>7} {row['hits']:>6} "
+            f"{row['hit_rate']:>6.1%} {row['median_latency']:>7.2f}s {row['builds_saved']:>8} "
+            f"{row['minutes_saved']:>9.0f}  {misses}"
+        )
+    checks = sum(row["checks"] for row in rows)
+    hits = sum(row["hits"] for row in rows)
+    print("-" * len(header))
+    print(
+        f"{'total':<24} {'':>5} {checks:>7} {hits:>6} {hits / checks if checks else 0:>6.1%} "
+        f"{'':>8} {sum(row['builds_saved'] for row in rows):>8} "
+        f"{sum(row['minutes_saved'] for row in rows):>9.0f}"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure how effective the frontend cache is."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser(
+        "report",
+        help="Aggregate the hit rate and saved build minutes per tree and LLVM version",
+    )
+    report_parser.add_argument(
+        "logs",
+        nargs="+",
+        metavar="log",
+        help="jsonl:<path>, sqlite:<path>, or the path of a JSONL file or job log",
+    )
+    report_parser.add_argument(
+        "--since", type=float, help="Only use the records of the last SINCE days"
+    )
+    report_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the report as JSON rather than a table",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    since = None if args.since is None else time.time() - args.since * 24 * 60 * 60
+    if not (all_records := read_records(args.logs, since)):
+        print("No records found")
+        sys.exit(1)
+    report = get_report(
+        all_records, get_workflow_costs(durations=load_build_durations())
+    )
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
@@ -0,0 +1,178 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+"""
+Delete the cache entries that are no longer used, keeping everything else.
+
+The entries that are live are computed from the generator configuration and
+the entries themselves:
+
+    _<WORKFLOW>     The entry of every workflow of every tree and LLVM version
+                    in tree_schedules (including the shards of workflows that
+                    are too big for one), anything else is for a tree or LLVM
+                    version that has been dropped.
+    _BUILDS_<NN>    The slots of the results store (see dedup.py), which
+                    expire old results themselves. Variables that are not one
+                    of its slots are from before it had a fixed size.
+    _REFS_<HASH>    The resolved refs of a repository (see refs.py) that a tree
+                    is still built from, unless it was last resolved more than
+                    --refs-max-age days ago.
+    _TOOLCHAINS     The toolchain manifest (see toolchains.py).
+
+Entries that are not valid JSON are deleted as well, they cannot be hit and
+would only be overwritten.
+
+Every cache entry is listed with a single paginated listing and the entries
+are deleted by a small pool of workers, so that the rate limit is not hit by
+a burst of requests:
+
+    $ caching/prune.py --dry-run
+"""
+
+import argparse
+import concurrent.futures
+import sys
+import time
+from typing import Dict, Iterable, Optional
+
+from backend import CacheEntryNotFoundError, get_backend
+from dedup import BUILDS_PREFIX, get_variable_names
+from refs import REFS_PREFIX, get_refs_var_name
+from toolchains import MANIFEST_VAR
+from utils import (
+    get_config_from_generator,
+    get_workflow_name_to_var_name,
+    get_workflows,
+)
+
+# How many entries are deleted at the same time. GitHub asks for mutating
+# requests not to be made concurrently, keep it small.
+DELETE_WORKERS = 4
+# Resolved refs are only used for a few minutes (refs.REFS_TTL), an entry that
+# has not been refreshed for this many days belongs to a repository that is not
+# checked anymore.
+REFS_MAX_AGE = 7
+
+
+def get_live_workflows(config) -> Dict[str, str]:
+    """
+    Returns the names of the cache entries of every workflow that the
+    generator creates and the names of those workflows.
+    """
+    workflows = {}
+    for item in config["tree_schedules"]:
+        for _, workflow_name, _ in get_workflows(
+            config, item["name"], item["llvm_version"]
+        ):
+            workflows[get_workflow_name_to_var_name(workflow_name)] = workflow_name
+    return workflows
+
+
+def get_garbage(
+    entries: Dict[str, Optional[dict]],
+    config,
+    refs_max_age: float = REFS_MAX_AGE,
+) -> Dict[str, str]:
+    """
+    Returns the names of the entries (from CacheBackend.list()) that can be
+    deleted and why.
+    """
+    live_workflows = get_live_workflows(config)
+    live_refs = {get_refs_var_name(tree["git_repo"]) for tree in config["trees"]}
+    live_builds = get_variable_names()
+
+    garbage = {}
+    for key, entry in entries.items():
+        if entry is None:
+            garbage[key] = "not valid JSON"
+        elif key in live_workflows or key == MANIFEST_VAR:
+            continue
+        elif key.startswith(BUILDS_PREFIX):
+            if key not in live_builds:
+                garbage[key] = "not a slot of the results store"
+        elif key.startswith(REFS_PREFIX):
+            age = (time.time() - entry.get("time", 0)) / (24 * 60 * 60)
+            if key not in live_refs:
+                garbage[key] = f"{entry.get('repo', 'repository')} is not built anymore"
+            elif age > refs_max_age:
+                garbage[key] = f"last resolved {age:.0f} days ago"
+        else:
+            garbage[key] = "no workflow has this name anymore"
+    return garbage
+
+
+def delete_entries(
+    backend, keys: Iterable[str], workers: int = DELETE_WORKERS
+) -> Dict[str, Exception]:
+    """
+    Deletes the entries with keys with a pool of workers and returns the ones
+    that could not be deleted along with the error. Entries that are already
+    gone are not errors.
+    """
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(backend.delete, key): key for key in keys}
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+            except CacheEntryNotFoundError:
+                print(f"{key} was already deleted")
+            # pylint: disable-next=broad-exception-caught
+            except Exception as err:
+                failures[key] = err
+            else:
+                print(f"Deleted {key}")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Delete the cache entries that are no longer used."
+    )
+    parser.add_argument(
+        "-g",
+        "--github-token",
+        help="Token for the GitHub backend (default: REPO_SCOPED_PAT)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=DELETE_WORKERS,
+        type=int,
+        help="How many entries to delete at once",
+    )
+    parser.add_argument(
+        "--refs-max-age",
+        default=REFS_MAX_AGE,
+        type=float,
+        help="Delete resolved refs that are older than this many days",
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="Only print what would be deleted"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cache_backend = get_backend(args.github_token)
+    all_entries = cache_backend.list()
+    to_delete = get_garbage(all_entries, get_config_from_generator(), args.refs_max_age)
+
+    for name, reason in sorted(to_delete.items()):
+        print(f"{name}: {reason}")
+    print(f"{len(to_delete)} of {len(all_entries)} cache entries are no longer used")
+    if args.dry_run or not to_delete:
+        sys.exit(0)
+
+    if failed := delete_entries(cache_backend, to_delete, args.jobs):
+        for name, error in sorted(failed.items()):
+            print(f"ERROR: Couldn't delete cache entry with key {name}: {error}")
+        sys.exit(1)
+    print(f"Deleted {len(to_delete)} cache entries")
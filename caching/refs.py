@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Resolve git refs to shas with one request per repository, shared between
+workflows.
+
+Every workflow of a tree (one per LLVM version) resolves the same ref and
+several trees live in the same repository (all of the stable branches are in
+stable-url), so rather than each check_cache job listing the refs of the
+repository on its own, the first one resolves every ref that is needed from it
+in a single request and stores the result in the cache backend for REFS_TTL
+seconds, where the others pick it up.
+
+The request is a protocol v2 ls-refs command with a ref-prefix for each ref,
+so the server only sends the refs that were asked for, rather than every
+branch and tag (thousands of them in linux-next) like 'git ls-remote' does
+(it does not pass its patterns on as ref-prefixes). It is sent to
+git-upload-pack over smart HTTP for http(s) URLs and to 'git upload-pack' for
+local repositories, which makes it easy to test against local bare
+repositories:
+
+    $ caching/refs.py --no-cache /tmp/linux.git master linux-6.6.y
+
+Annotated tags are resolved to the commit that they point to, which is what
+TuxSuite reports as git_sha.
+"""
+
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+import urllib.parse
+
+from api import get_client
+from backend import get_backend
+
+# How long resolved refs are used for before they are resolved again. Keep it
+# short: a ref that moves within it is picked up by the next scheduled run.
+REFS_TTL = 5 * 60
+# Cache entries for resolved refs start with this, followed by a hash of the
+# repository URL
+REFS_PREFIX = "_REFS_"
+
+FLUSH_PKT = b"0000"
+DELIM_PKT = b"0001"
+
+
+def get_refs_var_name(git_repo: str) -> str:
+    digest = hashlib.blake2b(git_repo.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{REFS_PREFIX}{digest.upper()}"
+
+
+def get_ref_candidates(git_ref: str) -> List[str]:
+    # Branches are preferred over tags, like 'git rev-parse' does
+    if git_ref == "HEAD" or git_ref.startswith("refs/"):
+        return [git_ref]
+    return [f"refs/heads/{git_ref}", f"refs/tags/{git_ref}"]
+
+
+def pkt_line(line: str) -> bytes:
+    data = line.encode("utf-8")
+    return f"{len(data) + 4:04x}".encode("ascii") + data
+
+
+def get_ls_refs_request(git_refs: Iterable[str]) -> bytes:
+    prefixes = sorted(
+        {prefix for ref in git_refs for prefix in get_ref_candidates(ref)}
+    )
+    return b"".join(
+        [
+            pkt_line("command=ls-refs\n"),
+            DELIM_PKT,
+            pkt_line("peel\n"),
+            *(pkt_line(f"ref-prefix {prefix}\n") for prefix in prefixes),
+            FLUSH_PKT,
+        ]
+    )
+
+
+def parse_ls_refs_response(response: bytes) -> Dict[str, str]:
+    """
+    Returns the names and shas of the refs in an ls-refs response, with
+    annotated tags peeled to the commit that they point to.
+    """
+    remote_refs = {}
+    pos = 0
+    while pos < len(response):
+        length = int(response[pos : pos + 4], 16)
+        if length in (0, 1):  # flush or delimiter
+            pos += 4
+            continue
+        line = response[pos + 4 : pos + length].decode("utf-8").rstrip("\n")
+        pos += length
+        if line.startswith("ERR "):
+            raise RuntimeError(f"Server returned an error: {line[4:]}")
+        sha, name, *attributes = line.split(" ")
+        for attribute in attributes:
+            if attribute.startswith("peeled:"):
+                sha = attribute[len("peeled:") :]
+        remote_refs[name] = sha
+    return remote_refs
+
+
+def list_remote_refs(git_repo: str, git_refs: Iterable[str]) -> Dict[str, str]:
+    """
+    Returns the names and shas of the refs of git_repo that git_refs could
+    refer to, in a single request.
+    """
+    request = get_ls_refs_request(git_refs)
+    if git_repo.startswith(("http://", "https://")):
+        response = get_client().request(
+            "POST",
+            f"{git_repo.rstrip('/')}/git-upload-pack",
+            request,
+            {
+                "Accept": "application/x-git-upload-pack-result",
+                "Content-Type": "application/x-git-upload-pack-request",
+                "Git-Protocol": "version=2",
+            },
+        )
+    else:
+        path = git_repo
+        if git_repo.startswith("file://"):
+            path = urllib.parse.unquote(urllib.parse.urlsplit(git_repo).path)
+        response = subprocess.run(
+            ["git", "upload-pack", "--stateless-rpc", path],
+            input=request,
+            capture_output=True,
+            check=True,
+            env={**os.environ, "GIT_PROTOCOL": "version=2"},
+        ).stdout
+    return parse_ls_refs_response(response)
+
+
+def match_ref(remote_refs: Dict[str, str], git_ref: str) -> Optional[str]:
+    """Returns the sha of git_ref from the output of list_remote_refs()."""
+    for candidate in get_ref_candidates(git_ref):
+        if candidate in remote_refs:
+            return remote_refs[candidate]
+    return None
+
+
+def resolve_refs(
+    git_repo: str,
+    git_refs: Iterable[str],
+    backend=None,
+    ttl: float = REFS_TTL,
+) -> Dict[str, str]:
+    """
+    Returns the shas of git_refs in git_repo, leaving out the refs that do
+    not exist. When backend (a cache backend from backend.py) is given,
+    refs resolved by another workflow within ttl seconds are used and new
+    results are stored there. Problems with the backend are not fatal, the
+    refs are then just resolved here.
+    """
+    git_refs = sorted(set(git_refs))
+    var_name = get_refs_var_name(git_repo)
+
+    entry = None
+    if backend is not None:
+        try:
+            entry = backend.get(var_name)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as err:
+            print(f"Could not look up resolved refs of {git_repo} ({err})")
+        if (
+            entry is not None
+            and entry.get("repo") == git_repo
+            and time.time() - entry.get("time", 0) <= ttl
+            and set(git_refs) <= set(entry.get("refs", {}))
+        ):
+            print(
+                f"Using refs of {git_repo} resolved {time.time() - entry['time']:.0f}s ago"
+            )
+            return {ref: entry["refs"][ref] for ref in git_refs}
+
+    remote_refs = list_remote_refs(git_repo, git_refs)
+    resolved = {
+        ref: sha for ref in git_refs if (sha := match_ref(remote_refs, ref)) is not None
+    }
+
+    if backend is not None:
+        value = {"repo": git_repo, "time": time.time(), "refs": resolved}
+        try:
+            if entry is None:
+                backend.create(var_name, value)
+            else:
+                backend.update(var_name, value)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as err:
+            print(f"Could not store resolved refs of {git_repo} ({err})")
+
+    return resolved
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Resolve git refs with one request per repository through the shared cache."
+    )
+    parser.add_argument("git_repo", help="URL or path of the repository")
+    parser.add_argument(
+        "git_refs", nargs="+", metavar="git_ref", help="Refs to resolve"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use the cache backend"
+    )
+    parser.add_argument(
+        "--ttl",
+        default=REFS_TTL,
+        type=float,
+        help="How long cached refs are used for in seconds",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cache_backend = None if args.no_cache else get_backend()
+    refs = resolve_refs(args.git_repo, args.git_refs, cache_backend, args.ttl)
+    for ref in args.git_refs:
+        print(f"{refs.get(ref, '-')}\t{ref}")
+    sys.exit(0 if set(args.git_refs) <= set(refs) else 1)
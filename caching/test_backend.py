@@ -0,0 +1,105 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+import backend
+from backend import (
+    CacheEntryConflictError,
+    CacheEntryExistsError,
+    CacheEntryNotFoundError,
+    GitHubBackend,
+    SQLiteBackend,
+    update_cache_entry,
+)
+from toolchains import MANIFEST_VAR, add_toolchain_version
+from variables_server import make_server
+
+KEY = "_MAINLINE_CLANG_21"
+JOBS = {f"builds_{idx}": "fail" if idx == 3 else "pass" for idx in range(1, 9)}
+
+
+@pytest.fixture(name="cache_backend", params=["github", "sqlite"])
+def fixture_cache_backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        yield SQLiteBackend(tmp_path / "cache.db")
+        return
+
+    server = make_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("GITHUB_API_URL", f"http://localhost:{server.server_address[1]}")
+    monkeypatch.delenv("CACHE_SNAPSHOT", raising=False)
+    # Only has to be longer than a request to the local server takes
+    monkeypatch.setattr(backend, "SETTLE_TIME", 0.2)
+    yield GitHubBackend("token")
+    server.shutdown()
+    server.server_close()
+
+
+def test_entry_lifecycle(cache_backend):
+    assert cache_backend.get(KEY) is None
+    cache_backend.create(KEY, {"build_status": "presuite"})
+    with pytest.raises(CacheEntryExistsError):
+        cache_backend.create(KEY, {})
+
+    cache_backend.update(KEY, {"build_status": "pass", "version": 1}, 0)
+    assert cache_backend.get(KEY, fresh=True) == {"build_status": "pass", "version": 1}
+    with pytest.raises(CacheEntryConflictError):
+        cache_backend.update(KEY, {}, expected_version=0)
+    assert list(cache_backend.list()) == [KEY]
+
+    cache_backend.delete(KEY)
+    with pytest.raises(CacheEntryNotFoundError):
+        cache_backend.delete(KEY)
+
+
+def test_concurrent_job_updates(cache_backend):
+    cache_backend.create(KEY, {"build_status": "presuite", "builds": {}, "jobs": {}})
+
+    def update(job):
+        update_cache_entry(
+            cache_backend,
+            KEY,
+            build_status=JOBS[job],
+            builds={job: [JOBS[job], ""]},
+            job=job,
+            expected_jobs=JOBS,
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(JOBS)) as executor:
+        for future in [executor.submit(update, job) for job in JOBS]:
+            future.result()
+
+    entry = cache_backend.get(KEY, fresh=True)
+    assert entry["jobs"] == JOBS
+    assert entry["builds"] == {job: [status, ""] for job, status in JOBS.items()}
+    assert entry["build_status"] == "fail"
+
+
+def test_concurrent_toolchain_versions(cache_backend):
+    images = {
+        f"docker.io/tuxmake/x86_64_korg-clang-{llvm}:latest": {
+            "digest": f"sha256:{llvm:064x}",
+            "version": f"clang version {llvm}.0.0",
+        }
+        for llvm in range(14, 22)
+    }
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(images)) as executor:
+        futures = [
+            executor.submit(
+                add_toolchain_version,
+                cache_backend,
+                image,
+                entry["digest"],
+                entry["version"],
+            )
+            for image, entry in images.items()
+        ]
+        for future in futures:
+            future.result()
+
+    manifest = cache_backend.get(MANIFEST_VAR, fresh=True)
+    for image, entry in images.items():
+        assert manifest[image].items() >= entry.items()
@@ -0,0 +1,77 @@
+import os
+import subprocess
+
+import pytest
+
+from backend import SQLiteBackend
+from refs import get_refs_var_name, resolve_refs
+
+
+def git(repo, *args):
+    return subprocess.run(
+        ["git", "-C", str(repo), *args],
+        capture_output=True,
+        check=True,
+        env={
+            **os.environ,
+            "GIT_AUTHOR_NAME": "CI",
+            "GIT_AUTHOR_EMAIL": "ci@example.com",
+            "GIT_COMMITTER_NAME": "CI",
+            "GIT_COMMITTER_EMAIL": "ci@example.com",
+        },
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture(name="repo")
+def fixture_repo(tmp_path):
+    """
+    Returns a bare repository and its commits: 'master' at the second commit,
+    an annotated 'v1.0' tag of the first, and a 'linux-6.6.y' branch at the
+    second commit next to a 'linux-6.6.y' tag of the first.
+    """
+    work = tmp_path / "work"
+    git(tmp_path, "init", "-q", "-b", "master", str(work))
+    commits = []
+    for idx in range(2):
+        git(work, "commit", "-q", "--allow-empty", "-m", f"commit {idx}")
+        commits.append(git(work, "rev-parse", "HEAD"))
+    git(work, "tag", "-a", "-m", "v1.0", "v1.0", commits[0])
+    git(work, "tag", "linux-6.6.y", commits[0])
+    git(work, "branch", "linux-6.6.y", commits[1])
+
+    bare = tmp_path / "linux.git"
+    git(tmp_path, "clone", "-q", "--bare", str(work), str(bare))
+    return bare, commits
+
+
+def test_resolve_refs(repo):
+    bare, commits = repo
+    assert git(bare, "rev-parse", "refs/tags/v1.0") != commits[0]
+
+    assert resolve_refs(str(bare), ["master", "v1.0", "linux-6.6.y", "missing"]) == {
+        "master": commits[1],
+        # Annotated tags are peeled to their commit
+        "v1.0": commits[0],
+        # Branches are preferred over tags with the same name
+        "linux-6.6.y": commits[1],
+    }
+
+
+def test_resolve_refs_cache(repo, tmp_path):
+    bare, commits = repo
+    backend = SQLiteBackend(tmp_path / "cache.db")
+    assert resolve_refs(str(bare), ["master"], backend) == {"master": commits[1]}
+    assert backend.get(get_refs_var_name(str(bare)))["refs"] == {"master": commits[1]}
+
+    # Moving the ref is not picked up until the cached result expires
+    git(bare, "update-ref", "refs/heads/master", commits[0])
+    assert resolve_refs(str(bare), ["master"], backend) == {"master": commits[1]}
+    assert resolve_refs(str(bare), ["master"], backend, ttl=0) == {"master": commits[0]}
+    assert resolve_refs(str(bare), ["master"], backend) == {"master": commits[0]}
+
+    # Refs that are not in the cached result are resolved
+    assert resolve_refs(str(bare), ["master", "v1.0"], backend) == {
+        "master": commits[0],
+        "v1.0": commits[0],
+    }
@@ -0,0 +1,97 @@
+import json
+import os
+from pathlib import Path
+
+import yaml
+
+import utils
+from utils import CI_ROOT, get_build_cache_key, normalize_make_variables
+
+
+def get_key(build):
+    return get_build_cache_key(
+        build["target_arch"], build["kconfig"], build.get("make_variables")
+    )
+
+
+def test_normalize_make_variables():
+    assert normalize_make_variables({"LLVM": 1, "LD": "ld.lld"}) == {
+        "LLVM": "1",
+        "LD": "ld.lld",
+    }
+    assert normalize_make_variables(None) == {}
+
+
+def test_plan_and_builds_json_keys_match():
+    # TuxSuite turns the integers of the plans into strings in builds.json
+    plan_build = {
+        "target_arch": "arm64",
+        "kconfig": ["defconfig"],
+        "make_variables": {"LLVM": 1, "LLVM_IAS": 1},
+    }
+    builds_json_build = {
+        "target_arch": "arm64",
+        "kconfig": ["defconfig"],
+        "make_variables": {"LLVM": "1", "LLVM_IAS": "1"},
+    }
+    assert get_key(plan_build) == get_key(builds_json_build)
+
+
+def test_mock_builds_json_keys_are_in_plans():
+    plan_keys = set()
+    for tuxsuite_yml in Path(CI_ROOT, "tuxsuite").glob("*.tux.yml"):
+        plan = yaml.safe_load(tuxsuite_yml.read_text(encoding="utf-8"))
+        plan_keys.update(
+            get_key(build) for job in plan["jobs"] for build in job["builds"]
+        )
+
+    builds = json.loads(Path(CI_ROOT, "mock.builds.json").read_text(encoding="utf-8"))
+    for build in builds["builds"].values():
+        assert get_key(build) in plan_keys
+
+
+def test_patches_hash_memo(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "CI_ROOT", tmp_path)
+    monkeypatch.setattr(utils, "PATCH_HASHES_CACHE", tmp_path / "patch_hashes.json")
+    monkeypatch.setattr(utils, "_patch_hashes", {})
+    monkeypatch.delenv("PATCHES_HASH", raising=False)
+    patches = tmp_path / "patches" / "mainline"
+    patches.mkdir(parents=True)
+    (patches / "0001-a.patch").write_text("a\n", encoding="utf-8")
+    (patches / "0002-b.patch").write_text("b\n", encoding="utf-8")
+
+    patches_hash = utils.get_patches_hash("mainline")
+    memo = json.loads(utils.PATCH_HASHES_CACHE.read_text(encoding="utf-8"))
+    assert sorted(memo) == sorted(str(patch) for patch in patches.iterdir())
+
+    # Another process uses the hashes on disk rather than reading the patches
+    memo[str(patches / "0001-a.patch")][2] = "00" * 64
+    utils.PATCH_HASHES_CACHE.write_text(json.dumps(memo), encoding="utf-8")
+    monkeypatch.setattr(utils, "_patch_hashes", {})
+    assert utils.get_patches_hash("mainline") != patches_hash
+
+    # Until the patch is touched
+    patch = patches / "0001-a.patch"
+    mtime_ns = patch.stat().st_mtime_ns + 10**9
+    os.utime(patch, ns=(mtime_ns, mtime_ns))
+    assert utils.get_patches_hash("mainline") == patches_hash
+
+
+def test_partition_builds_balances_costs():
+    config = utils.get_config_from_generator()
+    builds = [
+        build
+        for builds in utils.get_builds(config, "mainline", 21).values()
+        for build in builds
+    ]
+    for num_jobs in range(2, 9):
+        parts = utils.partition_builds(builds, num_jobs, len(builds), None)
+        assert len(parts) == num_jobs
+        assert sum(len(part) for part in parts) == len(builds)
+        assert min(len(part) for part in parts) > 1
+
+        costs = [
+            sum(utils.estimate_build_duration(build, None) for build in part)
+            for part in parts
+        ]
+        assert max(costs) <= 1.25 * min(costs)
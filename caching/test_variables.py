@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from variables import RepositoryVariables
+import variables_server
+from variables_server import make_server
+
+VARIABLES = {f"_VAR_{idx:03}": str(idx) for idx in range(250)}
+
+
+@pytest.fixture(name="server")
+def fixture_server(monkeypatch):
+    server = make_server(variables=VARIABLES)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("GITHUB_API_URL", f"http://localhost:{server.server_address[1]}")
+    monkeypatch.delenv("CACHE_SNAPSHOT", raising=False)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_list_pages(server, tmp_path):
+    client = RepositoryVariables("token", snapshot=tmp_path / "snapshot.json")
+    assert client.list() == VARIABLES
+    assert server.RequestHandlerClass.requests == 3
+
+    # Served from the snapshot
+    assert client.get("_VAR_042") == "42"
+    assert server.RequestHandlerClass.requests == 3
+
+
+@pytest.mark.usefixtures("server")
+def test_list_smaller_pages(monkeypatch):
+    # A server that does not return as many variables per page as asked for
+    monkeypatch.setattr(variables_server, "MAX_PER_PAGE", 30)
+    assert RepositoryVariables("token").list() == VARIABLES
+
+
+def test_get_without_snapshot(server):
+    client = RepositoryVariables("token")
+    assert client.get("_VAR_042") == "42"
+    assert client.get("_MISSING") is None
+    assert server.RequestHandlerClass.requests == 2
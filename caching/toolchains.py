@@ -0,0 +1,239 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+"""
+Look up the version of the clang in a tuxmake toolchain image without pulling
+it.
+
+check_cache needs the exact clang version that TuxSuite is going to build
+with. Rather than starting the multi-gigabyte tuxmake image to run
+'clang --version' every time, the digest of the image is looked up in the
+registry (a HEAD request for its manifest, which does not count as a pull) and
+mapped to a version with a manifest in the cache backend:
+
+    _TOOLCHAINS = {"version": ..., "docker.io/tuxmake/x86_64_korg-clang-18:latest": {"digest": ..., "version": ...}, ...}
+
+The images come from 'toolchain_image' in the generator configuration, which
+the workflows pass to check.py.
+
+When the digest is not in the manifest (a new image), the image is run once
+at that digest to find out its version, which is recorded for the next time.
+If that is not possible (such as without docker), the version is reported as
+unknown, which never matches a cached version, so the builds run and update.py
+records the version that TuxSuite reported for the digest that check.py saw
+(TOOLCHAIN_IMAGE), as long as the image has not changed in the meantime.
+
+    $ caching/toolchains.py korg-clang-18 clang-nightly
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import time
+from typing import Optional, Tuple
+import urllib.error
+import urllib.parse
+
+from api import get_client
+from backend import CacheEntryExistsError, get_backend, swap_cache_entry
+from utils import get_config_from_generator, get_toolchain_image
+
+MANIFEST_VAR = "_TOOLCHAINS"
+# Docker Hub's name in image references and the host of its registry API
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_REGISTRY_URL = "https://registry-1.docker.io"
+# How long pulling and running an image to get its version may take
+RUN_TIMEOUT = 15 * 60
+MANIFEST_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+)
+
+
+def parse_image(image: str) -> Tuple[str, str, str]:
+    """
+    Returns the registry URL, repository, and tag of an image reference like
+    'docker.io/tuxmake/x86_64_clang-nightly:latest', which follows the same
+    rules as docker does when parts of it are left out. TOOLCHAIN_REGISTRY_URL
+    overrides the registry, such as to use a mirror.
+    """
+    name, tag = image, "latest"
+    if ":" in image.rsplit("/", 1)[-1]:
+        name, tag = image.rsplit(":", 1)
+    host, _, repository = name.partition("/")
+    if not repository or ("." not in host and ":" not in host and host != "localhost"):
+        host, repository = DOCKER_HUB, name
+    if host == DOCKER_HUB and "/" not in repository:
+        repository = f"library/{repository}"
+    registry_url = DOCKER_HUB_REGISTRY_URL if host == DOCKER_HUB else f"https://{host}"
+    registry_url = os.environ.get("TOOLCHAIN_REGISTRY_URL", registry_url).rstrip("/")
+    return registry_url, repository, tag
+
+
+def get_registry_token(challenge: str) -> Optional[str]:
+    """
+    Returns an anonymous token for the scope in a WWW-Authenticate challenge
+    like 'Bearer realm="https://auth.docker.io/token",service="...",scope="..."'.
+    """
+    if not challenge.startswith("Bearer "):
+        return None
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    if (realm := params.pop("realm", None)) is None:
+        return None
+    result = get_client().request_json(
+        "GET", f"{realm}?{urllib.parse.urlencode(params)}"
+    )
+    return result.get("token") or result.get("access_token")
+
+
+def get_image_digest(image: str) -> Optional[str]:
+    registry_url, repository, tag = parse_image(image)
+    url = f"{registry_url}/v2/{repository}/manifests/{tag}"
+    headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+    client = get_client()
+    try:
+        _, response_headers = client.request_with_headers("HEAD", url, headers=headers)
+    except urllib.error.HTTPError as err:
+        if err.code != 401:
+            raise
+        if (
+            token := get_registry_token(err.headers.get("WWW-Authenticate", ""))
+        ) is None:
+            raise
+        headers["Authorization"] = f"Bearer {token}"
+        _, response_headers = client.request_with_headers("HEAD", url, headers=headers)
+    return response_headers.get("Docker-Content-Digest")
+
+
+def get_image_version(image_ref: str) -> Optional[str]:
+    """
+    Returns the clang version of image_ref (an image pinned to a digest) by
+    running it, like check.get_clang_version() does for the clang in PATH, or
+    None if it cannot be run.
+    """
+    try:
+        result = subprocess.run(
+            ["docker", "run", "--rm", image_ref, "clang", "--version"],
+            capture_output=True,
+            check=True,
+            text=True,
+            timeout=RUN_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError) as err:
+        print(f"Could not run {image_ref} ({err})")
+        return None
+    return result.stdout.splitlines()[0].strip() if result.stdout else None
+
+
+def get_toolchain_version(backend, image: str) -> Tuple[str, Optional[str]]:
+    """
+    Returns the clang version of image (a reference like the ones that
+    get_toolchain_image() returns, or a string saying that it is unknown) and
+    the reference with the digest that it was looked up with, if the digest
+    could be looked up.
+    """
+    try:
+        digest = get_image_digest(image)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        print(f"Could not look up the digest of {image} ({err})")
+        digest = None
+    if digest is None:
+        return f"unknown ({image})", None
+
+    image_ref = f"{image}@{digest}"
+    try:
+        manifest = backend.get(MANIFEST_VAR) or {}
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        print(f"Could not look up {MANIFEST_VAR} ({err})")
+        manifest = {}
+    if (entry := manifest.get(image)) is not None and entry.get("digest") == digest:
+        return entry["version"], image_ref
+
+    print(f"{image_ref} is not in {MANIFEST_VAR} yet, running it to get its version")
+    if (version := get_image_version(image_ref)) is None:
+        print(f"The version of {image_ref} will be recorded after the builds")
+        return f"unknown ({image_ref})", image_ref
+    try:
+        add_toolchain_version(backend, image, digest, version)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        print(f"Could not record the version of {image_ref}: {err}")
+    return version, image_ref
+
+
+def add_toolchain_version(backend, image: str, digest: str, version: str):
+    """
+    Records version for image at digest in the manifest. Concurrent kick jobs
+    may be updating the manifest as well, so it is updated with a
+    compare-and-swap on its "version" like the cache entries are.
+    """
+    entry = {"digest": digest, "version": version, "time": int(time.time())}
+    if (manifest := backend.get(MANIFEST_VAR, fresh=True)) is None:
+        try:
+            backend.create(MANIFEST_VAR, {"version": 0, image: entry})
+            print(f"Recorded {version} for {image}@{digest}")
+            return
+        except CacheEntryExistsError:
+            # Another job created it first, add to that one
+            pass
+    elif manifest.get(image, {}).get("digest") == digest:
+        return
+
+    def apply(manifest):
+        manifest[image] = entry
+        return manifest
+
+    swap_cache_entry(
+        backend,
+        MANIFEST_VAR,
+        apply,
+        lambda manifest: manifest.get(image, {}).get("digest") == digest,
+    )
+    print(f"Recorded {version} for {image}@{digest}")
+
+
+def record_toolchain_version(backend, image_ref: str, version: str):
+    """
+    Records version for the image and digest in image_ref (from
+    get_toolchain_version()) in the manifest, unless the image has changed
+    since then, as the builds may then have been done with the new image.
+    """
+    image, digest = image_ref.split("@", 1)
+    if (current := get_image_digest(image)) != digest:
+        print(
+            f"{image} changed ({digest} -> {current}) during the builds, not recording {version}"
+        )
+        return
+    add_toolchain_version(backend, image, digest, version)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Look up the clang version of tuxmake toolchain images without pulling them."
+    )
+    parser.add_argument(
+        "toolchains", nargs="+", metavar="toolchain", help="e.g. korg-clang-18"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cache_backend = get_backend()
+    generator_config = get_config_from_generator()
+    for toolchain_name in args.toolchains:
+        print(
+            get_toolchain_version(
+                cache_backend, get_toolchain_image(generator_config, toolchain_name)
+            )
+        )
@@ -22,17 +22,21 @@ system to not cache. The idea being that we want to rerun these jobs and not hav
 a caching system stop us from doing so -- even if sha and version match.
 """
 
+import concurrent.futures
 import json
 import os
 import sys
 import re
-import urllib.request
 from pathlib import Path
+from typing import Dict, List, Optional
 
+from api import get_client
+from backend import get_backend, update_cache_entry
+from toolchains import record_toolchain_version
 from utils import (
+    get_build_cache_key,
     get_patches_hash,
     get_workflow_name_to_var_name,
-    update_repository_variable,
 )
 
 if "GITHUB_WORKFLOW" not in os.environ:
@@ -41,29 +45,111 @@ if "GITHUB_WORKFLOW" not in os.environ:
 
 MOCK = "MOCK" in os.environ
 
+# The patches are applied before anything is built, so the block that says
+# which patches failed is near the top of build.log and only this much of it is
+# ever read.
+MAX_LOG_BYTES = 1024 * 1024
+# How many build logs are scanned at once
+LOG_SCAN_WORKERS = 8
+PATCH_FAILED_MARKER = "Apply patch set FAILED"
+FAILED_PATCHES_RE = re.compile(
+    r"(?<=Apply patch set FAILED\s)[0-9A-Za-z._:/\-\s]*?(?=\serror: )"
+)
+
 
-def update_cache(status: str, git_sha: str, clang_version: str, patches_hash: str):
+def update_cache(
+    status: str,
+    git_sha: Optional[str],
+    clang_version: Optional[str],
+    patches_hash: Optional[str],
+    build_results: dict,
+):
     print(f"Trying to update cache with status: {status}")
     cache_entry_key = get_workflow_name_to_var_name(os.environ["GITHUB_WORKFLOW"])
 
-    if "REPO_SCOPED_PAT" not in os.environ:
+    try:
+        backend = get_backend()
+    except KeyError:
         print("Couldn't find REPO_SCOPED_PAT in env. Not in a GitHub Workflow?")
         sys.exit(1)
 
-    headers = {"Authorization": f"Bearer {os.environ['REPO_SCOPED_PAT']}"}
-
-    update_repository_variable(
+    update_cache_entry(
+        backend,
         cache_entry_key,
-        http_headers=headers,
         build_status=status,
         sha=git_sha,
         clang_version=clang_version,
         patches_hash=patches_hash,
+        builds=build_results,
+        # The other kick_tuxsuite jobs of this workflow report their own
+        # status, the status of the workflow is derived from all of them.
+        job=os.environ.get("CACHE_JOB"),
+        expected_jobs=[
+            job for job in os.environ.get("CACHE_JOBS", "").split(",") if job
+        ],
         # prevent overriding a 'fail' to a 'pass'
         allow_fail_to_pass=False,
     )
 
 
+def get_settled_status() -> Optional[str]:
+    """
+    Returns the status that the builds of this job that were left out of the
+    TuxSuite plan because they were settled (see dedup.py) add up to, 'fail'
+    if one of them failed, or None if there were none.
+    """
+    reused_json = Path("reused.json")
+    if not reused_json.exists():
+        return None
+    settled = json.loads(reused_json.read_text(encoding="utf-8")).get("settled", {})
+    if not settled:
+        return None
+    return "fail" if "fail" in settled.values() else "pass"
+
+
+def scan_build_log(
+    download_url: str, max_bytes: int = MAX_LOG_BYTES
+) -> Optional[List[str]]:
+    """
+    Returns the patches that failed to apply according to the build.log of a
+    build, or None if it does not say. The log is streamed line by line from
+    the 'Apply patch set FAILED' block until the error that ends it, reading
+    no more than max_bytes of it.
+    """
+    block = None
+    read = 0
+    with get_client().stream(download_url + "build.log") as response:
+        while read < max_bytes and (line := response.readline(max_bytes - read)):
+            read += len(line)
+            text = line.decode("utf-8", errors="replace")
+            if block is None:
+                if PATCH_FAILED_MARKER not in text:
+                    continue
+                block = ""
+            block += text
+            if "error: " in text and (match := FAILED_PATCHES_RE.search(block)):
+                return match.group(0).split("\n")
+    return None
+
+
+def get_failed_patches(builds: List[dict]) -> Dict[str, Optional[List[str]]]:
+    """
+    Scans the logs of builds concurrently with scan_build_log(), returning
+    the result for each download_url.
+    """
+    workers = min(LOG_SCAN_WORKERS, len(builds))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            build["download_url"]: executor.submit(
+                scan_build_log, build["download_url"]
+            )
+            for build in builds
+        }
+        return {
+            download_url: future.result() for download_url, future in futures.items()
+        }
+
+
 def main():
     builds_json = Path(("mock." if MOCK else "") + "builds.json")
 
@@ -73,6 +159,15 @@ def main():
     builds = json.loads(raw)["builds"]
 
     if len(builds) == 0:
+        # dedup.py leaves builds that were already done out of the plan
+        reused_json = Path("reused.json")
+        if (
+            reused_json.exists()
+            and json.loads(reused_json.read_text(encoding="utf-8"))["remaining"] == 0
+        ):
+            print("Every build was settled, recording the status of this job.")
+            update_cache(get_settled_status() or "pass", None, None, None, {})
+            sys.exit(0)
         print("No builds present. Did Tuxsuite run?")
         sys.exit(1)
 
@@ -89,28 +184,28 @@ def main():
             builds_that_are_missing_metadata.append(entry)
 
     # some builds may be missing metadata due to patches failing to apply
-    for build_id in builds_that_are_missing_metadata:
-        build = builds[build_id]
-
-        if "Unable to apply kernel patch" not in build["status_message"]:
-            continue
-        req = urllib.request.Request(build["download_url"] + "build.log")
-        build_log_raw = ""
-        with urllib.request.urlopen(req) as response:
-            build_log_raw = response.read().decode()
-
-        failed_pattern = (
-            r"(?<=Apply patch set FAILED\s)[0-9A-Za-z._:/\-\s]*?(?=\serror: )"
-        )
-        failed_matches = re.findall(failed_pattern, build_log_raw)
-        if len(failed_matches) == 0:
+    patch_failures = [
+        builds[build_id]
+        for build_id in builds_that_are_missing_metadata
+        if "Unable to apply kernel patch" in builds[build_id]["status_message"]
+    ]
+    if patch_failures:
+        failed = {
+            download_url: patches
+            for download_url, patches in get_failed_patches(patch_failures).items()
+            if patches is not None
+        }
+        if not failed:
             print(
-                f"No patches failed to apply yet the build status stated there were: {build['status_message']}"
+                "No patches failed to apply yet the build status stated there were: "
+                f"{[build['status_message'] for build in patch_failures]}"
             )
             sys.exit(0)  # Not sure how we got here but continue the action anyways
 
-        patches_that_failed_to_apply = failed_matches[0].split('\n')
-        print(f"Error: Some patches failed to apply.\n{patches_that_failed_to_apply}\n")
+        for download_url, patches_that_failed_to_apply in failed.items():
+            print(
+                f"Error: Some patches failed to apply ({download_url}).\n{patches_that_failed_to_apply}\n"
+            )
         sys.exit(1)
 
     if len(builds_that_are_missing_metadata) == len(builds):
@@ -134,16 +229,42 @@ def main():
 
     print(f"Tuxsuite {git_sha = } | {clang_version = } | {patches_hash = }")
 
+    # Let check_cache find out the version of this toolchain image without
+    # starting it from now on (see toolchains.py)
+    if toolchain_image := os.environ.get("TOOLCHAIN_IMAGE"):
+        try:
+            record_toolchain_version(get_backend(), toolchain_image, clang_version)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as err:
+            print(f"Could not record the version of {toolchain_image}: {err}")
+
+    # Record the result of every build so that the ones that passed or failed
+    # are not done again if the workflow has to be rerun with the same inputs.
+    build_results = {
+        get_build_cache_key(
+            info["target_arch"], info["kconfig"], info.get("make_variables")
+        ): [
+            info["build_status"] if info["tuxbuild_status"] == "complete" else "badtux",
+            info.get("download_url", ""),
+        ]
+        for info in builds.values()
+    }
+
     for _, info in builds.items():
         if info["tuxbuild_status"] != "complete":
-            update_cache("badtux", git_sha, clang_version, patches_hash)
+            update_cache("badtux", git_sha, clang_version, patches_hash, build_results)
             sys.exit(0)
         if (status := info["build_status"]) != "pass":
-            update_cache(status, git_sha, clang_version, patches_hash)
+            update_cache(status, git_sha, clang_version, patches_hash, build_results)
             sys.exit(0)
 
+    # Builds that were left out because they were settled still count
+    if get_settled_status() == "fail":
+        update_cache("fail", git_sha, clang_version, patches_hash, build_results)
+        sys.exit(0)
+
     # only if all builds completed and passed will we set this status
-    update_cache("pass", git_sha, clang_version, patches_hash)
+    update_cache("pass", git_sha, clang_version, patches_hash, build_results)
     sys.exit(0)
 
 
@@ -0,0 +1,164 @@
+"""
+A small client for the GitHub Actions Repository Variables API, which is where
+the cache entries live.
+
+Listing the variables is paginated, so every cache entry can be fetched with a
+handful of requests rather than one per entry. The result can be kept in a
+local snapshot, from which single entries are served for as long as it is
+fresh, so that a run which needs several entries (or several runs on the same
+machine) do not have to go back to the API for each one.
+
+Requests go through the client from api.py that is shared by every
+RepositoryVariables with the same token, so they reuse its connections, ETags,
+retries, and rate limit throttling.
+
+The API that is used can be changed with GITHUB_API_URL (which GitHub Actions
+sets) and GITHUB_REPOSITORY, such as to point at the stand-in server in
+variables_server.py for testing.
+"""
+
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+import urllib.error
+import urllib.parse
+
+from api import get_client
+
+DEFAULT_API_URL = "https://api.github.com"
+DEFAULT_REPOSITORY = "ClangBuiltLinux/continuous-integration2"
+# The page size to list variables with, the maximum of the API
+PER_PAGE = 100
+# How long a snapshot can be used for before it has to be refreshed
+SNAPSHOT_TTL = 5 * 60
+# Cache entries are the Repository Variables that start with an underscore
+CACHE_PREFIX = "_"
+
+
+def get_variables_url():
+    api_url = os.environ.get("GITHUB_API_URL", DEFAULT_API_URL).rstrip("/")
+    repository = os.environ.get("GITHUB_REPOSITORY", DEFAULT_REPOSITORY)
+    return f"{api_url}/repos/{repository}/actions/variables"
+
+
+class RepositoryVariables:
+    def __init__(
+        self,
+        token: str,
+        snapshot: Optional[Path] = None,
+        snapshot_ttl: float = SNAPSHOT_TTL,
+    ):
+        self.url = get_variables_url()
+        self.client = get_client(token)
+        if snapshot is None and (env_snapshot := os.environ.get("CACHE_SNAPSHOT")):
+            snapshot = Path(env_snapshot)
+        self.snapshot = snapshot
+        self.snapshot_ttl = snapshot_ttl
+        # Changes made from several threads (such as concurrent deletes) must
+        # not undo each other in the snapshot
+        self._snapshot_lock = threading.Lock()
+
+    def _request(self, url, method="GET", data=None):
+        return self.client.request_json(method, url, data)
+
+    def _load_snapshot(self) -> Optional[Dict[str, str]]:
+        if self.snapshot is None:
+            return None
+        try:
+            snapshot = json.loads(self.snapshot.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if snapshot.get("url") != self.url:
+            return None
+        if time.time() - snapshot.get("time", 0) > self.snapshot_ttl:
+            return None
+        return snapshot["variables"]
+
+    def _save_snapshot(self, variables, taken=None):
+        if self.snapshot is None:
+            return
+        self.snapshot.parent.mkdir(exist_ok=True, parents=True)
+        # Write to a temporary file then move it into place so that concurrent
+        # readers never see a partially written snapshot.
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=self.snapshot.parent,
+            prefix=f"{self.snapshot.name}.",
+            delete=False,
+            encoding="utf-8",
+        ) as file:
+            json.dump(
+                {
+                    "url": self.url,
+                    "time": time.time() if taken is None else taken,
+                    "variables": variables,
+                },
+                file,
+            )
+        Path(file.name).replace(self.snapshot)
+
+    def _update_snapshot(self, name, value):
+        # Keep a fresh snapshot coherent with the changes made through this
+        # client, without extending its lifetime.
+        with self._snapshot_lock:
+            if (variables := self._load_snapshot()) is None:
+                return
+            taken = json.loads(self.snapshot.read_text(encoding="utf-8"))["time"]
+            if value is None:
+                variables.pop(name, None)
+            else:
+                variables[name] = value
+            self._save_snapshot(variables, taken)
+
+    def list(self, prefix: str = CACHE_PREFIX) -> Dict[str, str]:
+        """
+        Returns the names and values of every variable starting with prefix,
+        going through every page of results, and saves them as the snapshot.
+        """
+        variables = {}
+        page = 1
+        while True:
+            query = urllib.parse.urlencode({"per_page": PER_PAGE, "page": page})
+            result = self._request(f"{self.url}?{query}")
+            for variable in result["variables"]:
+                variables[variable["name"]] = variable["value"]
+            # Go by what was returned rather than PER_PAGE, in case the
+            # server uses smaller pages than what was asked for
+            if not result["variables"] or len(variables) >= result["total_count"]:
+                break
+            page += 1
+
+        self._save_snapshot(variables)
+        return {
+            name: value for name, value in variables.items() if name.startswith(prefix)
+        }
+
+    def get(self, name: str, use_snapshot: bool = True) -> Optional[str]:
+        """
+        Returns the value of a variable or None if it does not exist, from the
+        snapshot when it is fresh.
+        """
+        if use_snapshot and (variables := self._load_snapshot()) is not None:
+            return variables.get(name)
+        try:
+            return self._request(f"{self.url}/{name}")["value"]
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                return None
+            raise
+
+    def create(self, name: str, value: str):
+        self._request(self.url, "POST", {"name": name, "value": value})
+        self._update_snapshot(name, value)
+
+    def update(self, name: str, value: str):
+        self._request(f"{self.url}/{name}", "PATCH", {"name": name, "value": value})
+        self._update_snapshot(name, value)
+
+    def delete(self, name: str):
+        self._request(f"{self.url}/{name}", "DELETE")
+        self._update_snapshot(name, None)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the GitHub Actions Repository Variables API, for testing
+the caching scripts without touching the real cache.
+
+    $ caching/variables_server.py --port 8080 --seed variables.json &
+    $ GITHUB_API_URL=http://localhost:8080 caching/check.py ...
+
+It keeps the variables in memory and implements listing (with the same
+pagination as GitHub), getting, creating, updating, and deleting them. Every
+request is logged, so the number of API calls that a script makes can be
+counted. Like GitHub, GETs return an ETag and answer 304 to If-None-Match when
+nothing changed, and every response has X-RateLimit-* headers. --fail-every
+answers every Nth request with a 503 to exercise the retries in api.py.
+"""
+
+import argparse
+import contextlib
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import re
+import threading
+import time
+from typing import ClassVar, Dict
+from urllib.parse import parse_qs, urlparse
+
+PATH_RE = re.compile(r"^/repos/[^/]+/[^/]+/actions/variables(?:/([^/]+))?/?$")
+MAX_PER_PAGE = 100
+RATE_LIMIT = 5000
+
+
+class VariablesHandler(BaseHTTPRequestHandler):
+    # Set by make_server()
+    # Keep connections alive like GitHub does
+    protocol_version = "HTTP/1.1"
+    variables: ClassVar[Dict[str, str]] = {}
+    lock = threading.Lock()
+    fail_every = 0
+    requests = 0
+
+    def _reply(self, status, body=None):
+        content = b"" if body is None else json.dumps(body).encode("utf-8")
+        etag = None
+        if self.command == "GET" and status == 200:
+            etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+            if self.headers.get("If-None-Match") == etag:
+                status, content = 304, b""
+        self.send_response(status)
+        if content:
+            self.send_header("Content-Type", "application/json")
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("X-RateLimit-Limit", str(RATE_LIMIT))
+        self.send_header(
+            "X-RateLimit-Remaining", str(max(RATE_LIMIT - self.requests, 0))
+        )
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _parse(self):
+        with self.lock:
+            type(self).requests += 1
+            fail = self.fail_every and self.requests % self.fail_every == 0
+        if fail:
+            self._body()  # so that the connection can be kept alive
+            self._reply(503, {"message": "Service Unavailable"})
+            return None
+        url = urlparse(self.path)
+        if (match := PATH_RE.match(url.path)) is None:
+            self._body()
+            self._reply(404, {"message": "Not Found"})
+            return None
+        return match.group(1), parse_qs(url.query)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_GET(self):
+        if (parsed := self._parse()) is None:
+            return
+        name, query = parsed
+        with self.lock:
+            if name is None:
+                per_page = min(int(query.get("per_page", ["30"])[0]), MAX_PER_PAGE)
+                page = int(query.get("page", ["1"])[0])
+                names = sorted(self.variables)
+                variables = [
+                    {"name": item, "value": self.variables[item]}
+                    for item in names[(page - 1) * per_page : page * per_page]
+                ]
+                self._reply(200, {"total_count": len(names), "variables": variables})
+            elif name in self.variables:
+                self._reply(200, {"name": name, "value": self.variables[name]})
+            else:
+                self._reply(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        if (parsed := self._parse()) is None:
+            return
+        body = self._body()
+        with self.lock:
+            if parsed[0] is not None:
+                self._reply(404, {"message": "Not Found"})
+            elif body["name"] in self.variables:
+                self._reply(409, {"message": "Already exists"})
+            else:
+                self.variables[body["name"]] = body["value"]
+                self._reply(201, {})
+
+    def do_PATCH(self):
+        if (parsed := self._parse()) is None:
+            return
+        body = self._body()
+        with self.lock:
+            if (name := parsed[0]) not in self.variables:
+                self._reply(404, {"message": "Not Found"})
+            else:
+                self.variables[name] = body.get("value", self.variables[name])
+                self._reply(204)
+
+    def do_DELETE(self):
+        if (parsed := self._parse()) is None:
+            return
+        with self.lock:
+            if self.variables.pop(parsed[0], None) is None:
+                self._reply(404, {"message": "Not Found"})
+            else:
+                self._reply(204)
+
+
+class VariablesServer(ThreadingHTTPServer):
+    # The tests connect many jobs at once, and a connection that does not fit
+    # in the default backlog of 5 is only retried by the client a second later
+    request_queue_size = 64
+
+
+def make_server(port=0, variables=None, fail_every=0):
+    """
+    Returns a server for a fresh set of variables on localhost, on a free port
+    if port is 0 (server.server_address has the port that was picked).
+    """
+    handler = type(
+        "Handler",
+        (VariablesHandler,),
+        {
+            "variables": dict(variables or {}),
+            "lock": threading.Lock(),
+            "fail_every": fail_every,
+            "requests": 0,
+        },
+    )
+    return VariablesServer(("localhost", port), handler)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Serve a stand-in for the GitHub Actions Repository Variables API."
+    )
+    parser.add_argument(
+        "-p", "--port", default=8080, type=int, help="Port to listen on"
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=Path,
+        help="JSON file with a mapping of variable names to values to start with",
+    )
+    parser.add_argument(
+        "-f",
+        "--fail-every",
+        default=0,
+        metavar="N",
+        type=int,
+        help="Answer every Nth request with a 503",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    seed = json.loads(args.seed.read_text(encoding="utf-8")) if args.seed else {}
+    server = make_server(args.port, seed, args.fail_every)
+    print(
+        f"Serving {len(seed)} variables on http://localhost:{server.server_address[1]}"
+    )
+    with contextlib.suppress(KeyboardInterrupt):
+        server.serve_forever()
@@ -0,0 +1,295 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.8"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+"""
+Measure how the generator scales as the matrix grows.
+
+Synthetic generator configurations are created with every combination of the
+requested number of trees, LLVM versions, and configurations per tree and
+LLVM version. For each one, the time and peak memory of each phase of
+generation is measured:
+
+    * load: parsing the YAML with get_config_from_generator() (uncached and
+      without converting the builds)
+    * select: converting the builds into Build records, indexing them, and
+      selecting them for every tree and LLVM version
+    * tuxsuite: rendering every TuxSuite file (emit_tuxsuite_yml() without
+      writing to disk)
+    * workflow: rendering every GitHub Actions workflow (print_builds()
+      without writing to disk)
+
+The results can be saved as JSON with '-o' and compared against a previous
+run with '-c' to spot regressions between commits.
+"""
+
+from argparse import ArgumentParser
+import itertools
+import json
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# uv will ensure this is available
+# pylint: disable-next=import-error
+import yaml
+
+import generate_tuxsuite
+import generate_workflow
+import utils
+
+PHASES = ('load', 'select', 'tuxsuite', 'workflow')
+
+# A representative mix of the three kinds of configurations that get sorted
+# into different TuxSuite jobs, cycled through to create the requested number
+# of configurations.
+CONFIG_TEMPLATES = (
+    '{config: defconfig, ARCH: arm64, targets: [kernel]}',
+    '{config: [defconfig, CONFIG_LTO_CLANG_THIN=y], ARCH: arm64, targets: [kernel]}',
+    '{config: "https://example.com/config-%d.x86_64", targets: [kernel]}',
+    '{config: [allmodconfig, CONFIG_WERROR=n], ARCH: riscv, targets: [default]}',
+    '{config: allnoconfig, ARCH: arm, targets: [default], kernel_image: zImage}',
+)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__.split('\n\n', 1)[0].strip())
+    parser.add_argument(
+        '-c',
+        '--compare',
+        help='Previous results to compare against',
+        type=Path,
+    )
+    parser.add_argument(
+        '-k',
+        '--configs',
+        default=[60],
+        help='Numbers of configurations per tree and LLVM version (default: 60)',
+        nargs='+',
+        type=int,
+    )
+    parser.add_argument(
+        '-m',
+        '--llvm-versions',
+        default=[8],
+        help='Numbers of LLVM versions (default: 8)',
+        nargs='+',
+        type=int,
+    )
+    parser.add_argument(
+        '-n',
+        '--trees',
+        default=[10],
+        help='Numbers of trees (default: 10)',
+        nargs='+',
+        type=int,
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Save the results as JSON to this file',
+        type=Path,
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        default=3,
+        help='Number of times to time each phase, the fastest is reported (default: 3)',
+        type=int,
+    )
+    return parser.parse_args()
+
+
+def synthesize_config(yml_dir, num_trees, num_llvm_versions, num_configs):
+    """
+    Write a generator configuration with the requested dimensions to yml_dir,
+    mirroring the layout and anchor usage of generator/yml.
+    """
+    llvm_versions = range(100, 100 + num_llvm_versions)
+    trees = [f"tree{idx}" for idx in range(num_trees)]
+
+    Path(yml_dir, '0001-llvm_versions.yml').write_text(
+        'llvm_versions:\n'
+        + ''.join(f"  - &llvm_{ver} {{llvm_version: {ver}}}\n" for ver in llvm_versions)
+        + 'toolchain_image: docker.io/tuxmake/x86_64_{toolchain}:latest\n',
+        encoding='utf-8',
+    )
+    Path(yml_dir, '0003-schedules.yml').write_text(
+        'schedules:\n  - &daily {schedule: "0 0 * * *"}\n', encoding='utf-8'
+    )
+    Path(yml_dir, '0004-trees.yml').write_text(
+        'trees:\n'
+        + ''.join(
+            f"  - &{tree} {{git_repo: https://example.com/{tree}.git, git_ref: master, name: {tree}}}\n"
+            for tree in trees
+        )
+        + 'tree_schedules:\n'
+        + ''.join(
+            f"  - {{<< : *llvm_{ver}, << : *{tree}, << : *daily}}\n"
+            for tree, ver in itertools.product(trees, llvm_versions)
+        ),
+        encoding='utf-8',
+    )
+    Path(yml_dir, '0007-configs.yml').write_text(
+        'configs:\n'
+        + ''.join(
+            f"  - &config{idx} {CONFIG_TEMPLATES[idx % len(CONFIG_TEMPLATES)]}\n".replace(
+                '%d', str(idx)
+            )
+            for idx in range(num_configs)
+        ),
+        encoding='utf-8',
+    )
+    Path(yml_dir, '0008-tiers.yml').write_text(
+        'tiers:\n  - &llvm_full {make_variables: {LLVM: 1, LLVM_IAS: 1}}\n',
+        encoding='utf-8',
+    )
+    for ver in llvm_versions:
+        Path(yml_dir, f"0009-llvm-{ver}.yml").write_text(
+            ''.join(
+                f"  - {{<< : *config{idx}, << : *{tree}, << : *llvm_full, boot: {'true' if idx % 2 else 'false'}, << : *llvm_{ver}}}\n"
+                for tree, idx in itertools.product(trees, range(num_configs))
+            ),
+            encoding='utf-8',
+        )
+
+
+def run_phases(yml_dir):
+    """
+    Returns a dictionary of phase names to functions that run that phase. Each
+    phase depends on the configuration loaded by the 'load' phase.
+    """
+    state = {}
+
+    def load():
+        state['loaded_config'] = utils.get_config_from_generator(
+            use_cache=False, yml_dir=yml_dir, index_builds=False
+        )
+
+    def select():
+        # get_build_index() replaces the builds of the configuration that it
+        # indexes, start from the builds as they were loaded every time.
+        config = state['config'] = dict(state['loaded_config'])
+        for tree in config['trees']:
+            for llvm_ver in utils.get_llvm_versions(config, tree['name']):
+                utils.get_builds(config, tree['name'], llvm_ver)
+
+    def render_all(render):
+        config = state['config']
+        for tree in config['trees']:
+            for llvm_ver in utils.get_llvm_versions(config, tree['name']):
+                render(config, tree['name'], llvm_ver)
+
+    return {
+        'load': load,
+        'select': select,
+        'tuxsuite': lambda: render_all(generate_tuxsuite.render_tuxsuite_yml),
+        'workflow': lambda: render_all(generate_workflow.render_workflows),
+    }
+
+
+def measure(phases, repeat):
+    results = {}
+    # Time without tracemalloc, which has significant overhead, then run each
+    # phase one more time with it to get the peak memory usage.
+    for name, phase in phases.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            phase()
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        phase()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {'seconds': min(timings), 'peak_bytes': peak}
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            check=True,
+            cwd=utils.CI_ROOT,
+            text=True,
+        ).stdout.strip()
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return None
+
+
+def get_dimensions(result):
+    return (result['trees'], result['llvm_versions'], result['configs'])
+
+
+def print_results(results, previous=None):
+    previous_results = {
+        get_dimensions(result): result for result in (previous or {}).get('results', [])
+    }
+
+    header = f"{'trees':>5} {'llvm':>4} {'configs':>7} {'builds':>7}"
+    for phase in PHASES:
+        header += f" {phase + ' (s)':>13} {phase + ' (MiB)':>15}"
+    print(header)
+
+    for result in results:
+        row = f"{result['trees']:>5} {result['llvm_versions']:>4} {result['configs']:>7} {result['builds']:>7}"
+        old = previous_results.get(get_dimensions(result))
+        for phase in PHASES:
+            seconds = result['phases'][phase]['seconds']
+            mib = result['phases'][phase]['peak_bytes'] / 2**20
+            if old:
+                change = seconds / old['phases'][phase]['seconds']
+                row += f" {f'{seconds:.3f} x{change:.2f}':>13}"
+            else:
+                row += f" {seconds:>13.3f}"
+            row += f" {mib:>15.1f}"
+        print(row)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    benchmark = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'pyyaml': yaml.__version__,
+        'libyaml': hasattr(yaml, 'CSafeDumper'),
+        'results': [],
+    }
+    for tree_count, llvm_count, config_count in itertools.product(
+        args.trees, args.llvm_versions, args.configs
+    ):
+        print(
+            f"Benchmarking {tree_count} trees x {llvm_count} LLVM versions x {config_count} configurations...",
+            file=sys.stderr,
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            synthesize_config(tmpdir, tree_count, llvm_count, config_count)
+            benchmark['results'].append(
+                {
+                    'trees': tree_count,
+                    'llvm_versions': llvm_count,
+                    'configs': config_count,
+                    'builds': tree_count * llvm_count * config_count,
+                    'phases': measure(run_phases(tmpdir), args.repeat),
+                }
+            )
+
+    print_results(
+        benchmark['results'],
+        json.loads(args.compare.read_text(encoding='utf-8')) if args.compare else None,
+    )
+
+    if args.output:
+        args.output.write_text(json.dumps(benchmark, indent=4), encoding='utf-8')
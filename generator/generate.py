@@ -6,15 +6,40 @@
 # ]
 # ///
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import difflib
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
 import re
 import subprocess
 import sys
+import time
+
+# uv will ensure this is available
+# pylint: disable-next=import-error
+import yaml
 
 import generate_tuxsuite
 import generate_workflow
 import utils
 
+# Records a hash of everything that goes into each generated file, so that
+# files whose inputs have not changed can be skipped.
+MANIFEST = Path(utils.GENERATOR_CACHE, 'manifest.json')
+# The last version of LLVM's main branch that was fetched and when
+LLVM_TOT_VERSION_CACHE = Path(utils.GENERATOR_CACHE, 'llvm_tot_version.json')
+
+
+def positive_int(value):
+    if (number := int(value)) < 1:
+        raise ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
 
 def parse_args(trees):
     parser = ArgumentParser(description='Generate yml files and perform extra checks')
@@ -23,7 +48,43 @@ def parse_args(trees):
         '-c',
         '--check',
         action='store_true',
-        help='Fail if generating yml files results in a diff',
+        help='Fail if generating yml files results in a diff, without modifying any files',
+    )
+    parser.add_argument(
+        '--check-emitter',
+        action='store_true',
+        help='Fail if the fast YAML emitter does not produce the same files as the reference one',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='Number of processes to generate files with (default: 1)',
+        type=positive_int,
+    )
+    parser.add_argument(
+        '-f',
+        '--force',
+        action='store_true',
+        help='Regenerate all files, even if their inputs have not changed',
+    )
+    parser.add_argument(
+        '--llvm-tot-ttl',
+        default=3600,
+        help='Number of seconds that a fetched LLVM tip of tree version is reused for (default: 3600)',
+        type=int,
+    )
+    parser.add_argument(
+        '-o',
+        '--offline',
+        action='store_true',
+        help='Do not fetch the LLVM tip of tree version, trust generator/LLVM_TOT_VERSION',
+    )
+    parser.add_argument(
+        '-t',
+        '--timings',
+        action='store_true',
+        help='Show how long loading the configuration and generating files took',
     )
     parser.add_argument(
         'trees',
@@ -37,7 +98,7 @@ def parse_args(trees):
     return parser.parse_args()
 
 
-def update_llvm_tot_version():
+def fetch_llvm_tot_version():
     # Avoids pulling in an extra Python package dependency
     curl_cmd = [
         'curl',
@@ -50,59 +111,389 @@ def update_llvm_tot_version():
 
     if not (match := re.search(r'set\(LLVM_VERSION_MAJOR (\d+)', cmakelists)):
         raise RuntimeError('Could not find LLVM_VERSION_MAJOR?')
+    return match.group(1)
+
+
+def get_llvm_tot_version(ttl, offline):
+    """
+    Returns what the contents of LLVM_TOT_VERSION should be. In order of
+    preference, the version comes from:
+
+      * The LLVM_TOT_VERSION environment variable
+      * LLVM_TOT_VERSION itself, when offline is True
+      * A version that was fetched less than ttl seconds ago
+      * LLVMVersion.cmake in llvm-project's main branch
+    """
     if not utils.LLVM_TOT_VERSION.exists():
         raise RuntimeError(
             f"LLVM_TOT_VERSION does not exist in {utils.LLVM_TOT_VERSION.parent}?"
         )
-    utils.LLVM_TOT_VERSION.write_text(f"{match.group(1)}\n", encoding='utf-8')
+
+    if version := os.environ.get('LLVM_TOT_VERSION'):
+        if not version.strip().isdigit():
+            utils.die(
+                f"LLVM_TOT_VERSION from the environment ('{version}') is not a number?"
+            )
+        return f"{int(version)}\n"
+
+    if offline:
+        return utils.LLVM_TOT_VERSION.read_text(encoding='utf-8')
+
+    try:
+        cached = json.loads(LLVM_TOT_VERSION_CACHE.read_text(encoding='utf-8'))
+        if 0 <= time.time() - cached['time'] < ttl:
+            return f"{cached['version']}\n"
+    except (FileNotFoundError, KeyError, TypeError, json.JSONDecodeError):
+        pass
+
+    version = fetch_llvm_tot_version()
+    LLVM_TOT_VERSION_CACHE.parent.mkdir(exist_ok=True, parents=True)
+    LLVM_TOT_VERSION_CACHE.write_text(
+        json.dumps({'time': time.time(), 'version': version}), encoding='utf-8'
+    )
+    return f"{version}\n"
+
+
+def update_llvm_tot_version(ttl, offline):
+    utils.write_if_changed(utils.LLVM_TOT_VERSION, get_llvm_tot_version(ttl, offline))
+
+
+def hash_text(text):
+    return hashlib.blake2b(text.encode('utf-8')).hexdigest()
 
 
-def generate(config, tree):
-    print(f"Generating TuxSuite and GitHub Actions files for {tree}...")
-    for llvm_ver in utils.get_llvm_versions(config, tree):
-        generate_tuxsuite.emit_tuxsuite_yml(config, tree, llvm_ver)
-        generate_workflow.print_builds(config, tree, llvm_ver)
+def get_input_hashes(config, trees):
+    """
+    Hash everything that the files generated for each (tree, LLVM version)
+    pair depend on: the builds for that pair, the tree and its schedule,
+    the patches for the tree, LLVM_TOT_VERSION, and the generator itself.
+    """
+    base = hashlib.blake2b()
+    for source in (
+        __file__,
+        generate_tuxsuite.__file__,
+        generate_workflow.__file__,
+        utils.__file__,
+        utils.LLVM_TOT_VERSION,
+    ):
+        base.update(Path(source).read_bytes())
+    # Trees with 'tuxsuite_jobs' are partitioned with the build duration model
+    if utils.BUILD_DURATIONS.exists():
+        base.update(utils.BUILD_DURATIONS.read_bytes())
 
+    hashes = {}
+    for tree in trees:
+        repo, ref = utils.get_repo_ref(config, tree)
+        patches_hash = utils.get_patches_hash(tree)
+        for llvm_ver in utils.get_llvm_versions(config, tree):
+            inputs = {
+                'tree': [tree, repo, ref],
+                # The other refs of the repository are in the workflows
+                'git_refs': utils.get_git_refs(config, repo),
+                'toolchain_image': config['toolchain_image'],
+                'schedule': utils.get_tree_schedule(config, tree, llvm_ver),
+                'patches': patches_hash,
+                'builds': utils.get_builds(config, tree, llvm_ver),
+            }
+            hasher = base.copy()
+            hasher.update(json.dumps(inputs).encode('utf-8'))
+            hashes[(tree, llvm_ver)] = hasher.hexdigest()
+    return hashes
 
-def check(trees_arg):
+
+def load_manifest():
     try:
-        subprocess.run(
-            ['git', 'rev-parse', '--git-dir'], check=True, capture_output=True
+        return json.loads(MANIFEST.read_text(encoding='utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest, work, rendered):
+    for tree, llvm_ver, input_hash in work:
+        manifest[f"{tree}/{llvm_ver}"] = {
+            'input': input_hash,
+            'outputs': {
+                path: hash_text(text) for path, text in rendered[(tree, llvm_ver)]
+            },
+        }
+    MANIFEST.parent.mkdir(exist_ok=True, parents=True)
+    MANIFEST.write_text(
+        json.dumps(manifest, indent=4, sort_keys=True), encoding='utf-8'
+    )
+
+
+def is_up_to_date(manifest, tree, llvm_ver, input_hash):
+    if (entry := manifest.get(f"{tree}/{llvm_ver}")) is None:
+        return False
+    if entry['input'] != input_hash:
+        return False
+    # Make sure the files on disk are still the ones that were generated, in
+    # case they were modified by hand or by switching branches.
+    for output, output_hash in entry['outputs'].items():
+        if not (file := Path(utils.CI_ROOT, output)).exists():
+            return False
+        if hash_text(file.read_text(encoding='utf-8')) != output_hash:
+            return False
+    return True
+
+
+def get_work(config, trees, manifest):
+    """
+    Returns a list of (tree, LLVM version, input hash) tuples that need to be
+    generated, skipping any whose inputs and outputs match the manifest.
+    """
+    input_hashes = get_input_hashes(config, trees)
+    work = []
+    for tree in trees:
+        for llvm_ver in sorted(utils.get_llvm_versions(config, tree), key=str):
+            input_hash = input_hashes[(tree, llvm_ver)]
+            if not is_up_to_date(manifest, tree, llvm_ver, input_hash):
+                work.append((tree, llvm_ver, input_hash))
+    return work
+
+
+def render(config, tree, llvm_ver):
+    return [
+        generate_tuxsuite.render_tuxsuite_yml(config, tree, llvm_ver),
+        *generate_workflow.render_workflows(config, tree, llvm_ver),
+    ]
+
+
+def check_emitter(config, work):
+    """
+    Render every file with the (libyaml based when available) emitter that is
+    normally used and the pure Python emitters that it replaced, failing if
+    there are any differences between them.
+    """
+    if not hasattr(yaml, 'CSafeDumper'):
+        utils.warn(
+            'PyYAML was built without libyaml, the fast emitter is the pure Python one'
         )
-    except subprocess.CalledProcessError:
-        # Print a nicer error message versus spewing the exception
-        print('Script is not being run inside a git repository!')
+
+    diffs = []
+    for tree, llvm_ver, _ in work:
+        print(f"Comparing YAML emitters for {tree} (clang-{llvm_ver})...")
+        for fast, reference in zip(
+            render(config, tree, llvm_ver),
+            [
+                generate_tuxsuite.render_tuxsuite_yml(
+                    config, tree, llvm_ver, dumper=utils.NoAliasDumper
+                ),
+                *generate_workflow.render_workflows(
+                    config, tree, llvm_ver, dumper=yaml.Dumper
+                ),
+            ],
+        ):
+            if fast != reference:
+                path = fast[0]
+                diffs.append(
+                    difflib.unified_diff(
+                        reference[1].splitlines(keepends=True),
+                        fast[1].splitlines(keepends=True),
+                        f"reference/{path}",
+                        f"fast/{path}",
+                    )
+                )
+
+    if diffs:
+        print('\nThe fast YAML emitter generated the following differences:\n')
+        for diff in diffs:
+            sys.stdout.writelines(diff)
         sys.exit(1)
 
-    if subprocess.run(
-        ['git', '--no-optional-locks', 'status', '-uno', '--porcelain'],
-        capture_output=True,
-        check=True,
-    ).stdout:
-        print(
-            f"\nRunning 'generate.py {trees_arg}' generated the following diff:\n",
-            flush=True,
-        )
-        subprocess.run(['git', '--no-pager', 'diff', 'HEAD'], check=True)
+
+def generate(config, work):
+    rendered = {}
+    for tree, llvm_ver, _ in work:
         print(
-            "\nPlease run 'generate.py all' locally then commit and push the changes it creates!"
+            f"Generating TuxSuite and GitHub Actions files for {tree} (clang-{llvm_ver})..."
         )
+        rendered[(tree, llvm_ver)] = render(config, tree, llvm_ver)
+    return rendered
+
+
+# The parsed configuration is handed to each worker process once when it is
+# started, rather than pickled along with every (tree, LLVM version) task.
+_WORKER_CONFIG = {}
+
+
+def _init_worker(config):
+    _WORKER_CONFIG.update(config)
+
+
+def _generate_worker(tree, llvm_ver):
+    # Capture anything printed to stderr (such as the message from
+    # utils.die()) so that the parent can report errors in a stable order,
+    # rather than the order that the workers happen to fail in.
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            return render(_WORKER_CONFIG, tree, llvm_ver), None
+    # pylint: disable-next=broad-exception-caught
+    except (Exception, SystemExit) as err:
+        return None, stderr.getvalue() or f"{type(err).__name__}: {err}\n"
+
+
+def generate_parallel(config, work, jobs):
+    # Build the index before the workers are started so that it is shared
+    # with them, instead of each worker building it from scratch.
+    utils.get_build_index(config)
+
+    futures = {}
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(config,)
+    ) as executor:
+        for tree, llvm_ver, _ in work:
+            print(
+                f"Generating TuxSuite and GitHub Actions files for {tree} (clang-{llvm_ver})..."
+            )
+            futures[(tree, llvm_ver)] = executor.submit(
+                _generate_worker, tree, llvm_ver
+            )
+
+    rendered = {}
+    errors = []
+    for (tree, llvm_ver), future in futures.items():
+        files, error = future.result()
+        if error:
+            errors.append((tree, llvm_ver, error))
+        else:
+            rendered[(tree, llvm_ver)] = files
+    if errors:
+        for tree, llvm_ver, error in errors:
+            print(f"\nGenerating {tree} (clang-{llvm_ver}) failed:", file=sys.stderr)
+            print(error, end='', file=sys.stderr)
         sys.exit(1)
+    return rendered
+
+
+def write(rendered):
+    for files in rendered.values():
+        for path, text in files:
+            utils.write_if_changed(Path(utils.CI_ROOT, path), text)
+
+
+def get_orphaned_files(rendered):
+    generated = {path for files in rendered.values() for path, _ in files}
+    candidates = [
+        *Path(utils.CI_ROOT, 'tuxsuite').glob('*.tux.yml'),
+        *Path(utils.CI_ROOT, '.github/workflows').glob('*-clang-*.yml'),
+    ]
+    return sorted(
+        path
+        for file in candidates
+        if (path := str(file.relative_to(utils.CI_ROOT))) not in generated
+    )
+
+
+def get_diff(path, expected):
+    if (file := Path(utils.CI_ROOT, path)).exists():
+        current = file.read_text(encoding='utf-8')
+    else:
+        current = ''
+    return list(
+        difflib.unified_diff(
+            current.splitlines(keepends=True),
+            expected.splitlines(keepends=True),
+            f"a/{path}",
+            f"b/{path}",
+        )
+    )
+
+
+def check(trees_arg, rendered, llvm_tot_version, check_orphans):
+    """
+    Compare the rendered files against the ones on disk without modifying
+    anything, printing a diff of the files that differ.
+    """
+    diffs = []
+    tot_path = str(utils.LLVM_TOT_VERSION.relative_to(utils.CI_ROOT))
+    diffs.append(get_diff(tot_path, llvm_tot_version))
+    for files in rendered.values():
+        for path, text in files:
+            diffs.append(get_diff(path, text))
+    orphans = get_orphaned_files(rendered) if check_orphans else []
+
+    if not (any(diffs) or orphans):
+        return
+
+    trees_desc = 'all' if 'all' in trees_arg else ' '.join(trees_arg)
+    print(
+        f"\nRunning 'generate.py {trees_desc}' generated the following diff:\n",
+        flush=True,
+    )
+    for diff in diffs:
+        sys.stdout.writelines(diff)
+    if orphans:
+        print('\nThe following files are no longer generated and should be removed:\n')
+        print('\n'.join(orphans))
+    print(
+        "\nPlease run 'generate.py all' locally then commit and push the changes it creates!"
+    )
+    sys.exit(1)
 
 
 if __name__ == '__main__':
     # The list of valid trees come from the input, so we parse the input, then
     # check command line flags.
+    start = time.perf_counter()
     generated_config = utils.get_config_from_generator()
+    config_time = time.perf_counter() - start
     all_trees = [tree['name'] for tree in generated_config['trees']]
     args = parse_args(all_trees)
 
-    # Ensure that the LLVM_TOT_VERSION file is up to date
-    update_llvm_tot_version()
+    if args.check:
+        # The rendered files are compared against the current LLVM_TOT_VERSION
+        # file, an out of date file will be reported as drift.
+        current_llvm_tot_version = get_llvm_tot_version(args.llvm_tot_ttl, args.offline)
+    else:
+        # Ensure that the LLVM_TOT_VERSION file is up to date
+        update_llvm_tot_version(args.llvm_tot_ttl, args.offline)
+
+    if args.timings:
+        print(f"Loaded configuration in {config_time:.3f}s")
+        start = time.perf_counter()
+        utils.get_config_from_generator(use_cache=False)
+        print(
+            f"Parsing configuration without cache takes {time.perf_counter() - start:.3f}s"
+        )
 
+    start = time.perf_counter()
     # If 'all' is found in trees, it overrides all other choices.
-    for tree_name in all_trees if 'all' in args.trees else args.trees:
-        generate(generated_config, tree_name)
+    requested_trees = all_trees if 'all' in args.trees else args.trees
+    # Checking always renders every file, as the manifest only describes what
+    # was last generated locally.
+    generator_manifest = (
+        {} if args.force or args.check or args.check_emitter else load_manifest()
+    )
+    generator_work = get_work(generated_config, requested_trees, generator_manifest)
+    if args.check_emitter:
+        check_emitter(generated_config, generator_work)
+    if args.jobs == 1:
+        generator_output = generate(generated_config, generator_work)
+    else:
+        generator_output = generate_parallel(
+            generated_config, generator_work, args.jobs
+        )
 
     if args.check:
-        check(args.trees)
+        check(
+            args.trees,
+            generator_output,
+            current_llvm_tot_version,
+            'all' in args.trees,
+        )
+    else:
+        write(generator_output)
+        save_manifest(generator_manifest, generator_work, generator_output)
+
+        if skipped := sum(
+            len(utils.get_llvm_versions(generated_config, tree))
+            for tree in requested_trees
+        ) - len(generator_work):
+            print(
+                f"Skipped {skipped} up to date tree and LLVM version combinations (use --force to regenerate them)"
+            )
+
+    if args.timings:
+        print(f"Generated files in {time.perf_counter() - start:.3f}s")
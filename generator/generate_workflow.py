@@ -9,7 +9,6 @@
 import argparse
 import hashlib
 from pathlib import Path
-import sys
 
 # uv will ensure this is available
 # pylint: disable-next=import-error
@@ -18,14 +17,25 @@ import yaml
 from utils import (
     CI_ROOT,
     LLVM_TOT_VERSION,
-    disable_subsys_werror_configs,
+    FastNoAliasDumper,
+    get_build_cache_key,
     get_config_from_generator,
+    get_git_refs,
+    get_toolchain_image,
     get_llvm_versions,
+    get_patches_hash,
     get_repo_ref,
+    get_workflows,
     patch_series_flag,
     die,
+    write_if_changed,
 )
 
+# The snapshot of the cache that check_cache takes and passes on to the
+# kick_tuxsuite jobs, so that their lookups do not each go to the API (see
+# caching/variables.py). It is only used while it is fresh.
+CACHE_SNAPSHOT = "cache-snapshot.json"
+
 
 def parse_args(trees):
     parser = argparse.ArgumentParser(
@@ -39,7 +49,7 @@ def parse_args(trees):
     return parser.parse_args()
 
 
-def initial_workflow(name, cron, tuxsuite_yml, workflow_yml):
+def initial_workflow(name, cron, tuxsuite_yml, workflow_yml, patches_hash):
     return {
         "name": name,
         "on": {
@@ -64,44 +74,15 @@ def initial_workflow(name, cron, tuxsuite_yml, workflow_yml):
             "workflow_dispatch": None
         },
         "permissions": "read-all",
+        "env": {
+            # So that the caching scripts do not have to hash the patches
+            # (see utils.get_patches_hash())
+            "PATCHES_HASH": patches_hash
+        },
         "jobs": {}
     }  # fmt: off
 
 
-def print_config(build):
-    config = build["config"]
-    if isinstance(config, list):
-        config_name = config[0]
-        i = 1
-        while i < len(config):
-            config_name += "+" + config[i]
-            i += 1
-    else:
-        config_name = config
-    return config_name
-
-
-def get_job_name(build):
-    job = "ARCH=" + build.get("ARCH", "x86_64")
-    # BOOT=1 is the default, only show if we have disabled it
-    if not build["boot"]:
-        job += " BOOT=0"
-    # LLVM=0 does not make much sense. Translate LLVM=0 into CC=clang
-    if "LLVM" in build["make_variables"]:
-        job += " LLVM=1"
-    else:
-        job += " CC=clang"
-    # If LD was specified, show what it is
-    if "LD" in build["make_variables"]:
-        job += " LD=" + str(build["make_variables"]["LD"])
-    job += " LLVM_IAS=" + str(build["make_variables"]["LLVM_IAS"])
-    # Having "LLVM <VER>" is a little hard to parse, make it look like
-    # an environment variable
-    job += " LLVM_VERSION=" + str(build["llvm_version"])
-    job += " " + print_config(build)
-    return job
-
-
 def sanitize_job_name(name):
     return "_" + hashlib.new("md5", name.encode("utf-8")).hexdigest()
 
@@ -124,7 +105,7 @@ def check_patches_job_setup(repo, ref, tree_name):
     }  # fmt: off
 
 
-def check_cache_job_setup(repo, ref, toolchain):
+def check_cache_job_setup(config, repo, ref, toolchain):
     with LLVM_TOT_VERSION.open(encoding='utf-8') as fd:
         llvm_tot_version = fd.read().strip()
 
@@ -140,15 +121,22 @@ def check_cache_job_setup(repo, ref, toolchain):
         "check_cache": {
             "name": "Check Cache",
             "runs-on": "ubuntu-latest",
-            "container": f"tuxmake/x86_64_{toolchain}",
             "needs": "check_patches",
             "env": {
                 "GIT_REPO": repo,
-                "GIT_REF": ref
+                "GIT_REF": ref,
+                # Resolved along with GIT_REF for the other workflows of GIT_REPO
+                "GIT_REFS": ",".join(get_git_refs(config, repo)),
+                "TOOLCHAIN": get_toolchain_image(config, toolchain),
+                "CACHE_SNAPSHOT": CACHE_SNAPSHOT
             },
             "outputs": {
                 "output": "${{ steps.step2.outputs.output }}",
-                "status": "${{ steps.step2.outputs.status }}"
+                "status": "${{ steps.step2.outputs.status }}",
+                "sha": "${{ steps.step2.outputs.sha }}",
+                "clang_version": "${{ steps.step2.outputs.clang_version }}",
+                "toolchain_image": "${{ steps.step2.outputs.toolchain_image }}",
+                "settled": "${{ steps.step2.outputs.settled }}"
             },
             "steps": [
                 {
@@ -164,19 +152,30 @@ def check_cache_job_setup(repo, ref, toolchain):
                     "run": "caching/check.py -w '${{ github.workflow }}' "
                            "-g ${{ secrets.REPO_SCOPED_PAT }} "
                            "-r ${{ env.GIT_REF }} "
-                           "-o ${{ env.GIT_REPO }}",
+                           "-o ${{ env.GIT_REPO }} "
+                           "--git-refs ${{ env.GIT_REFS }} "
+                           "-t ${{ env.TOOLCHAIN }}",
+                },
+                {
+                    "name": "save cache snapshot",
+                    "uses": "actions/upload-artifact@v7",
+                    "with": {
+                        "path": CACHE_SNAPSHOT,
+                        "name": "cache_snapshot",
+                        "if-no-files-found": "ignore"
+                    },
                 },
                 {
                     "name": "Save exit code to GITHUB_OUTPUT",
                     "id": "step2",
-                    "run": 'echo "output=${{ steps.step1.outcome }}" >> "$GITHUB_OUTPUT" && echo "status=$CACHE_PASS" >> "$GITHUB_OUTPUT"',
+                    "run": 'echo "output=${{ steps.step1.outcome }}" >> "$GITHUB_OUTPUT" && echo "status=$CACHE_PASS" >> "$GITHUB_OUTPUT" && echo "sha=$LINUX_SHA" >> "$GITHUB_OUTPUT" && echo "clang_version=$CLANG_VERSION" >> "$GITHUB_OUTPUT" && echo "toolchain_image=$TOOLCHAIN_IMAGE" >> "$GITHUB_OUTPUT" && echo "settled=$SETTLED_BUILDS" >> "$GITHUB_OUTPUT"',
                 },
             ],
         }
     }  # fmt: off
 
 
-def tuxsuite_setups(job_name, tuxsuite_yml, repo, ref):
+def tuxsuite_setups(job_name, tuxsuite_yml, repo, ref, cache_jobs):
     patch_series = patch_series_flag(tuxsuite_yml.split("/")[1].split("-clang-")[0])
     cond = {"if": "${{ needs.check_cache.outputs.output == 'failure' || github.event_name == 'workflow_dispatch' }}"}  # fmt: off
     return {
@@ -188,7 +187,16 @@ def tuxsuite_setups(job_name, tuxsuite_yml, repo, ref):
             "needs": ["check_cache", "check_patches"],
             "env": {
                 "TUXSUITE_TOKEN": "${{ secrets.TUXSUITE_TOKEN }}",
-                "REPO_SCOPED_PAT": "${{ secrets.REPO_SCOPED_PAT }}"
+                "REPO_SCOPED_PAT": "${{ secrets.REPO_SCOPED_PAT }}",
+                "LINUX_SHA": "${{ needs.check_cache.outputs.sha }}",
+                "CLANG_VERSION": "${{ needs.check_cache.outputs.clang_version }}",
+                "TOOLCHAIN_IMAGE": "${{ needs.check_cache.outputs.toolchain_image }}",
+                "SETTLED_BUILDS": "${{ needs.check_cache.outputs.settled }}",
+                # The status of the workflow in the cache is derived from the
+                # statuses that each of these jobs report
+                "CACHE_JOB": job_name,
+                "CACHE_JOBS": ",".join(cache_jobs),
+                "CACHE_SNAPSHOT": CACHE_SNAPSHOT
             },
             "timeout-minutes": 480,
             "steps": [
@@ -210,10 +218,32 @@ def tuxsuite_setups(job_name, tuxsuite_yml, repo, ref):
                     "uses": "astral-sh/setup-uv@v10.0.0",
                     **cond,
                 },
+                {
+                    "name": "fetch cache snapshot",
+                    **cond,
+                    # Without it, the lookups go to the API
+                    "continue-on-error": True,
+                    "uses": "actions/download-artifact@v8",
+                    "with": {
+                        "name": "cache_snapshot"
+                    },
+                },
+                {
+                    "name": "Reuse identical builds",
+                    **cond,
+                    # dedup.py does every build when results cannot be looked
+                    # up, anything else that fails is a bug that should show
+                    "run": f"caching/dedup.py filter -j {job_name} -t {tuxsuite_yml} -o dedup.tux.yml",
+                },
                 {
                     "name": "tuxsuite",
                     **cond,
-                    "run": f"tuxsuite plan --git-repo {repo} --git-ref {ref} --job-name {job_name} --json-out builds.json {patch_series}{tuxsuite_yml} || true",
+                    "run": f"tuxsuite plan --git-repo {repo} --git-ref {ref} --job-name {job_name} --json-out builds.json {patch_series}dedup.tux.yml || true",
+                },
+                {
+                    "name": "Merge reused builds",
+                    **cond,
+                    "run": "caching/dedup.py merge",
                 },
                 {
                     "name": "Update Cache Build Status",
@@ -251,7 +281,7 @@ def tuxsuite_setups(job_name, tuxsuite_yml, repo, ref):
 
 
 def get_steps(build, build_set):
-    name = get_job_name(build)
+    name = build.job_name
     return {
         sanitize_job_name(name): {
             "runs-on": "ubuntu-latest",
@@ -259,10 +289,12 @@ def get_steps(build, build_set):
             "name": name,
             "if": "${{ needs.check_cache.outputs.status != 'pass' }}",
             "env": {
-                "ARCH": build.get("ARCH", "x86_64"),
-                "LLVM_VERSION": build["llvm_version"],
-                "BOOT": int(build["boot"]),
-                "CONFIG": print_config(build),
+                "ARCH": build.arch,
+                "LLVM_VERSION": build.llvm_version,
+                "BOOT": int(build.boot),
+                "CONFIG": build.config_name,
+                "CACHE_KEY": get_build_cache_key(build.arch, build.config, build.make_variables),
+                "SETTLED_BUILDS": "${{ needs.check_cache.outputs.settled }}",
                 "REPO_SCOPED_PAT": "${{ secrets.REPO_SCOPED_PAT }}"
             },
             "container": {
@@ -307,59 +339,54 @@ def get_cron_schedule(schedules, tree_name, llvm_version):
     return die(f"Could not find schedule for {tree_name} clang-{llvm_version}?")
 
 
-def print_builds(config, tree_name, llvm_version):
+def render_workflows(config, tree_name, llvm_version, dumper=FastNoAliasDumper):
+    """
+    Returns a list of (path, contents) tuples for the GitHub Actions workflow
+    files of tree_name and llvm_version, with paths relative to the root of
+    the repository.
+
+    There is normally a single workflow but if the builds do not fit within
+    GitHub's limit on the number of jobs in a workflow, they are sharded
+    across several workflows (see get_workflows()), which all use the same
+    TuxSuite file.
+    """
     repo, ref = get_repo_ref(config, tree_name)
     toolchain = f"clang-{llvm_version}"
     tuxsuite_yml = f"tuxsuite/{tree_name}-{toolchain}.tux.yml"
-    github_yml = f".github/workflows/{tree_name}-{toolchain}.yml"
-
-    check_logs_defconfigs = {}
-    check_logs_distribution_configs = {}
-    check_logs_allconfigs = {}
-    for build in config["builds"]:
-        if (
-            build["git_repo"] == repo
-            and build["git_ref"] == ref
-            and build["llvm_version"] == llvm_version
-        ):
-            disable_subsys_werror_configs(build["config"])
-            cfg_str = str(build["config"])
-            if "defconfig" in cfg_str:
-                check_logs_defconfigs.update(get_steps(build, "defconfigs"))
-            elif "https://" in cfg_str:
-                check_logs_distribution_configs.update(
-                    get_steps(build, "distribution_configs")
-                )
-            else:
-                check_logs_allconfigs.update(get_steps(build, "allconfigs"))
-
-    workflow_name = f"{tree_name} ({toolchain})"
     cron_schedule = get_cron_schedule(config["tree_schedules"], tree_name, llvm_version)
-    workflow = initial_workflow(workflow_name, cron_schedule, tuxsuite_yml, github_yml)
+    patches_hash = get_patches_hash(tree_name)
+
+    workflows = []
+    for github_yml, workflow_name, shard in get_workflows(
+        config, tree_name, llvm_version
+    ):
+        workflow = initial_workflow(
+            workflow_name, cron_schedule, tuxsuite_yml, github_yml, patches_hash
+        )
 
-    workflow['jobs'].update(check_patches_job_setup(repo, ref, tree_name))
-    workflow['jobs'].update(check_cache_job_setup(repo, ref, toolchain))
-    workflow["jobs"].update(tuxsuite_setups("defconfigs", tuxsuite_yml, repo, ref))
-    workflow["jobs"].update(check_logs_defconfigs)
+        workflow['jobs'].update(check_patches_job_setup(repo, ref, tree_name))
+        workflow['jobs'].update(check_cache_job_setup(config, repo, ref, toolchain))
+        cache_jobs = [job_name for job_name, _ in shard]
+        for job_name, builds in shard:
+            workflow["jobs"].update(
+                tuxsuite_setups(job_name, tuxsuite_yml, repo, ref, cache_jobs)
+            )
+            for build in builds:
+                workflow["jobs"].update(get_steps(build, job_name))
+
+        lines = [
+            "# DO NOT MODIFY MANUALLY!",
+            "# This file has been autogenerated by invoking:",
+            f"# $ ./generate_workflow.py {tree_name}",
+            yaml.dump(workflow, Dumper=dumper, width=1000, sort_keys=False),
+        ]
+        workflows.append((github_yml, "\n".join(lines) + "\n"))
+    return workflows
 
-    if check_logs_distribution_configs:
-        workflow["jobs"].update(
-            tuxsuite_setups("distribution_configs", tuxsuite_yml, repo, ref)
-        )
-        workflow["jobs"].update(check_logs_distribution_configs)
-
-    if check_logs_allconfigs:
-        workflow["jobs"].update(tuxsuite_setups("allconfigs", tuxsuite_yml, repo, ref))
-        workflow["jobs"].update(check_logs_allconfigs)
-
-    with Path(CI_ROOT, github_yml).open("w", encoding='utf-8') as file:
-        orig_stdout = sys.stdout
-        sys.stdout = file
-        print("# DO NOT MODIFY MANUALLY!")
-        print("# This file has been autogenerated by invoking:")
-        print(f"# $ ./generate_workflow.py {tree_name}")
-        print(yaml.dump(workflow, Dumper=yaml.Dumper, width=1000, sort_keys=False))
-        sys.stdout = orig_stdout
+
+def print_builds(config, tree_name, llvm_version):
+    for github_yml, text in render_workflows(config, tree_name, llvm_version):
+        write_if_changed(Path(CI_ROOT, github_yml), text)
 
 
 if __name__ == "__main__":
@@ -302,6 +302,15 @@ if __name__ == "__main__":
             print_red(f"ERROR: ${var} must be specified")
         show_builds()
         sys.exit(1)
+    # Builds that already passed or failed with the same inputs were not done
+    # again, their result is in the cache.
+    if os.environ.get("GITHUB_EVENT_NAME") != "workflow_dispatch":
+        settled = json.loads(os.environ.get("SETTLED_BUILDS") or "{}")
+        if (status := settled.get(os.environ.get("CACHE_KEY"))) is not None:
+            info(
+                f"Build previously finished with status '{status}' with the same inputs, not checking it again."
+            )
+            sys.exit(0 if status == "pass" else 1)
     verified_build = verify_build()
     info("Register clang error/warning problem matchers")
     for problem_matcher in glob.glob(".github/problem-matchers/*.json"):
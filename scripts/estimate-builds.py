@@ -16,14 +16,21 @@ import datetime
 # pylint: disable-next=import-error
 import croniter
 
-from utils import get_config_from_generator
+from utils import (
+    estimate_build_duration,
+    get_builds,
+    get_config_from_generator,
+    load_build_durations,
+)
 
 config = get_config_from_generator()
+durations = load_build_durations()
 
 now = datetime.datetime.now(tz=datetime.timezone.utc)
 week_from_now = now + datetime.timedelta(weeks=1)
 
 builds_per_tree = defaultdict(lambda: defaultdict(lambda: 0))
+hours_per_tree = defaultdict(lambda: defaultdict(lambda: 0))
 for tree in config['tree_schedules']:
     tree_name = tree['name']
     tree_llvm_ver = tree['llvm_version']
@@ -31,25 +38,42 @@ for tree in config['tree_schedules']:
     # Calculate the number of times that a workflow runs in a week based on its
     # schedule
     num_runs = len(list(croniter.croniter_range(now, week_from_now, tree['schedule'])))
-    for build in config['builds']:
-        if (
-            tree['git_repo'] == build['git_repo']
-            and tree['git_ref'] == build['git_ref']
-            and tree_llvm_ver == build['llvm_version']
-        ):
-            builds_per_tree[tree_name]['total'] += num_runs
-            builds_per_tree[tree_name][tree_llvm_ver] += num_runs
+    builds = [
+        build
+        for kind_builds in get_builds(config, tree_name, tree_llvm_ver).values()
+        for build in kind_builds
+    ]
+    num_builds = len(builds)
+    builds_per_tree[tree_name]['total'] += num_runs * num_builds
+    builds_per_tree[tree_name][tree_llvm_ver] += num_runs * num_builds
+
+    build_hours = (
+        sum(estimate_build_duration(build, durations) for build in builds) / 3600
+    )
+    hours_per_tree[tree_name]['total'] += num_runs * build_hours
+    hours_per_tree[tree_name][tree_llvm_ver] += num_runs * build_hours
+
+if durations is None:
+    print(
+        'No build duration model found, build hours are rough guesses (see scripts/fit-build-durations.py)\n'
+    )
 
 total_builds = sum(item['total'] for item in builds_per_tree.values())
 print(f"Total builds per week: {total_builds}")
+total_hours = sum(item['total'] for item in hours_per_tree.values())
+print(f"Total build hours per week: {total_hours:.1f}")
 
 # Sort the list of builds by total number of builds descending
 for tree, builds in sorted(
     builds_per_tree.items(), key=lambda x: x[1]['total'], reverse=True
 ):
     print(f"\n  - tree: {tree}")
-    print(f"    total: {builds['total']}")
+    print(
+        f"    total: {builds['total']} ({hours_per_tree[tree]['total']:.1f} build hours)"
+    )
     print('    breakdown:')
     for clang_version, num_builds in builds.items():
         if clang_version != 'total':
-            print(f"    - clang-{clang_version}: {num_builds}")
+            print(
+                f"    - clang-{clang_version}: {num_builds} ({hours_per_tree[tree][clang_version]:.1f} build hours)"
+            )
@@ -0,0 +1,109 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.8"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+
+# pylint: disable=invalid-name
+
+import argparse
+import json
+from pathlib import Path
+import statistics
+
+from utils import (
+    BUILD_DURATIONS,
+    CI_ROOT,
+    die,
+    get_build_duration_key,
+    get_config_kind,
+    warn,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fit build duration estimates from TuxSuite builds.json files."
+    )
+    parser.add_argument(
+        "directory",
+        type=Path,
+        help="Directory with saved builds.json files (searched recursively for *.json)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=BUILD_DURATIONS,
+        type=Path,
+        help=f"Where to write the model (default: {BUILD_DURATIONS.relative_to(CI_ROOT)})",
+    )
+    return parser.parse_args()
+
+
+def get_durations(directory):
+    """
+    Yields (target_arch, kind, toolchain, duration) for every build that
+    TuxSuite completed in the builds.json files in directory.
+    """
+    for file in sorted(directory.rglob('*.json')):
+        try:
+            builds = json.loads(file.read_text(encoding='utf-8'))['builds']
+        except (json.JSONDecodeError, KeyError, TypeError, UnicodeDecodeError):
+            warn(f"{file} does not look like a builds.json file, skipping it")
+            continue
+
+        for build in builds.values():
+            # Builds that TuxSuite could not complete (timeouts, infrastructure
+            # problems) say nothing about how long a build actually takes.
+            if build.get('tuxbuild_status', 'complete') != 'complete':
+                continue
+            if (
+                not isinstance(duration := build.get('duration'), (int, float))
+                or duration <= 0
+            ):
+                continue
+            yield (
+                build['target_arch'],
+                get_config_kind(build['kconfig']),
+                build['toolchain'],
+                duration,
+            )
+
+
+def fit(durations):
+    samples = {}
+    for arch, kind, toolchain, duration in durations:
+        for table, key in get_build_duration_key(arch, kind, toolchain).items():
+            samples.setdefault(table, {}).setdefault(key, []).append(duration)
+
+    # The median is used rather than the mean so that a handful of builds that
+    # sat in a queue or hit a slow machine do not skew the estimates.
+    return {
+        table: {
+            key: {'duration': statistics.median(values), 'samples': len(values)}
+            for key, values in sorted(entries.items())
+        }
+        for table, entries in sorted(samples.items())
+    }
+
+
+def main():
+    args = parse_args()
+
+    if not args.directory.is_dir():
+        die(f"{args.directory} is not a directory?")
+    if not (model := fit(get_durations(args.directory))):
+        die(f"No completed builds with a duration found in {args.directory}?")
+
+    args.output.write_text(json.dumps(model, indent=4) + '\n', encoding='utf-8')
+
+    num_builds = sum(entry['samples'] for entry in model['by_kind'].values())
+    print(
+        f"Fit {len(model['by_arch_kind_toolchain'])} build duration estimates from {num_builds} builds, saved to {args.output}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -89,6 +89,9 @@ ci_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 def svg(workflow):
     if workflow is None:
         return "   "
+    # Workflows that have been sharded get one badge per shard in the same cell.
+    if isinstance(workflow, list):
+        return " ".join(svg(shard) for shard in workflow)
     workflow_url = f"https://github.com/clangbuiltlinux/continuous-integration2/actions/workflows/{workflow}.yml"
     badge_url = f"https://kernel.outflux.net/cbl/badges/{workflow}.svg"
     return f"[![{workflow} build status]({badge_url})]({workflow_url})"
@@ -96,14 +99,15 @@ def svg(workflow):
 
 print("Copy and paste the output below into README.md:\n")
 
-# Be able to location and extract the name of a workflow.
-name_re = re.compile(r'^name: (.*) \(([^\)]+)\)$')
+# Be able to location and extract the name of a workflow, ignoring the
+# ' [<n>/<total>]' suffix of sharded workflows.
+name_re = re.compile(r'^name: (.*) \(([^\)]+)\)(?: \[\d+/\d+\])?$')
 # Quick "basename $arg .yml" regular expression.
 base_re = re.compile(r'^.*/([^/]+)\.yml$')
 
 # Find all the tuxsuite workflows.
 trees = {}
-for yml in glob.glob(f"{ci_root}/.github/workflows/*.yml"):
+for yml in sorted(glob.glob(f"{ci_root}/.github/workflows/*.yml")):
     tuxsuite = False
     tree = None
     compiler = None
@@ -126,7 +130,7 @@ for yml in glob.glob(f"{ci_root}/.github/workflows/*.yml"):
     m = base_re.search(yml)
     base = m.group(1)
     trees.setdefault(tree, {})
-    trees[tree][compiler] = base
+    trees[tree].setdefault(compiler, []).append(base)
 
 # Construct the list of all compilers seen by any tree.
 compilers = set()
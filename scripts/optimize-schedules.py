@@ -0,0 +1,254 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.8"
+# dependencies = [
+#     "pyyaml>=6.0.3",
+# ]
+# ///
+
+# pylint: disable=invalid-name
+
+import argparse
+from pathlib import Path
+import re
+
+from utils import (
+    GENERATOR_ROOT,
+    die,
+    estimate_workflow_hours,
+    get_builds,
+    get_config_from_generator,
+    get_schedule_hours,
+    load_build_durations,
+)
+
+HOURS_PER_WEEK = 7 * 24
+
+SCHEDULES_YML = Path(GENERATOR_ROOT, 'yml/0003-schedules.yml')
+TREES_YML = Path(GENERATOR_ROOT, 'yml/0004-trees.yml')
+
+# '  - &weekdays_six         {schedule: "0 6 * * 1,2,3,4,5"}'
+SCHEDULE_RE = re.compile(r'^\s*- &(\S+)\s+\{schedule: "([^"]+)"\}', flags=re.M)
+# '  - &mainline_llvm_tot    {<< : *llvm_tot,     << : *mainline,     << : *weekdays_six}'
+TREE_SCHEDULE_RE = re.compile(r'^(\s*- &\S+\s+\{.*<< : \*)([^\s,}]+)(.*\}\s*)$')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Propose schedules for tree_schedules that minimize the peak number of concurrent builds while keeping how often each tree and LLVM version pair runs."
+    )
+    parser.add_argument(
+        "-p",
+        "--pin",
+        default=[],
+        metavar="TREE",
+        nargs="+",
+        help="Trees whose schedules should not be changed (e.g. ones that must run after upstream updates)",
+    )
+    parser.add_argument(
+        "-w",
+        "--write",
+        action="store_true",
+        help=f"Rewrite {TREES_YML.relative_to(GENERATOR_ROOT.parent)} with the proposed schedules",
+    )
+    return parser.parse_args()
+
+
+def get_frequency(schedule):
+    # The number of days and the number of times per day that a schedule runs
+    fields = schedule.split(' ')
+    return len(fields[-1].split(',')), len(fields[1].split(','))
+
+
+def add_load(load, schedule, builds, duration, sign=1):
+    for day, hour in get_schedule_hours(schedule):
+        start = day * 24 + hour
+        for offset in range(duration):
+            load[(start + offset) % HOURS_PER_WEEK] += sign * builds
+
+
+def score(load):
+    # Minimize the peak first, then flatten the rest of the week so that the
+    # next highest peaks come down as well.
+    return max(load), sum(val * val for val in load)
+
+
+def get_workflows(config, schedules):
+    cron_to_anchor = {cron: anchor for anchor, cron in reversed(schedules.items())}
+    durations = load_build_durations()
+    workflows = []
+    for tree in config['tree_schedules']:
+        if (anchor := cron_to_anchor.get(tree['schedule'])) is None:
+            die(
+                f"{tree['name']} (clang-{tree['llvm_version']}) uses a schedule ('{tree['schedule']}') that is not in {SCHEDULES_YML.name}?"
+            )
+        builds = [
+            build
+            for kind_builds in get_builds(
+                config, tree['name'], tree['llvm_version']
+            ).values()
+            for build in kind_builds
+        ]
+        workflows.append(
+            {
+                'name': tree['name'],
+                'llvm_version': tree['llvm_version'],
+                'anchor': anchor,
+                'builds': len(builds),
+                'duration': estimate_workflow_hours(tree['name'], builds, durations),
+            }
+        )
+    return workflows
+
+
+def get_week_load(workflows, schedules, assignment):
+    load = [0] * HOURS_PER_WEEK
+    for idx, workflow in enumerate(workflows):
+        add_load(
+            load, schedules[assignment[idx]], workflow['builds'], workflow['duration']
+        )
+    return load
+
+
+def optimize(workflows, schedules, pinned, passes=10):
+    assignment = [workflow['anchor'] for workflow in workflows]
+    candidates = {}
+    for anchor, cron in schedules.items():
+        candidates.setdefault(get_frequency(cron), []).append(anchor)
+
+    # Place the workflows that contribute the most load first, as they have
+    # the biggest impact on the peak, starting from an empty week with just the
+    # pinned workflows.
+    movable = [
+        idx for idx, workflow in enumerate(workflows) if workflow['name'] not in pinned
+    ]
+    movable.sort(
+        key=lambda idx: (
+            workflows[idx]['builds']
+            * workflows[idx]['duration']
+            * len(get_schedule_hours(schedules[assignment[idx]]))
+        ),
+        reverse=True,
+    )
+    load = [0] * HOURS_PER_WEEK
+    for idx, workflow in enumerate(workflows):
+        if idx not in movable:
+            add_load(
+                load,
+                schedules[assignment[idx]],
+                workflow['builds'],
+                workflow['duration'],
+            )
+
+    def get_cost(workflow, anchor):
+        add_load(load, schedules[anchor], workflow['builds'], workflow['duration'])
+        # Prefer the current schedule on ties to avoid needless churn
+        cost = (*score(load), anchor != workflow['anchor'])
+        add_load(load, schedules[anchor], workflow['builds'], workflow['duration'], -1)
+        return cost
+
+    def place(idx):
+        workflow = workflows[idx]
+        current = assignment[idx]
+        # The schedules with the same frequency always include the current one
+        assignment[idx] = min(
+            candidates[get_frequency(schedules[current])],
+            key=lambda anchor: get_cost(workflow, anchor),
+        )
+        add_load(
+            load, schedules[assignment[idx]], workflow['builds'], workflow['duration']
+        )
+        return assignment[idx] != current
+
+    for idx in movable:
+        place(idx)
+
+    # Then repeatedly move single workflows to wherever the week is best
+    # balanced until nothing improves.
+    for _ in range(passes):
+        changed = False
+        for idx in movable:
+            workflow = workflows[idx]
+            add_load(
+                load,
+                schedules[assignment[idx]],
+                workflow['builds'],
+                workflow['duration'],
+                -1,
+            )
+            changed |= place(idx)
+        if not changed:
+            break
+
+    return assignment
+
+
+def write_trees_yml(workflows, assignment):
+    lines = TREES_YML.read_text(encoding='utf-8').splitlines(keepends=True)
+    matches = [
+        (idx, match)
+        for idx, line in enumerate(lines)
+        if (match := TREE_SCHEDULE_RE.match(line))
+    ]
+    if len(matches) != len(workflows):
+        die(
+            f"Found {len(matches)} tree schedules in {TREES_YML.name} but the configuration has {len(workflows)}?"
+        )
+
+    for (idx, match), workflow, anchor in zip(matches, workflows, assignment):
+        if match.group(2) != workflow['anchor']:
+            die(
+                f"Expected '*{workflow['anchor']}' for {workflow['name']} (clang-{workflow['llvm_version']}) in {TREES_YML.name}, found '*{match.group(2)}'?"
+            )
+        lines[idx] = f"{match.group(1)}{anchor}{match.group(3)}"
+
+    TREES_YML.write_text(''.join(lines), encoding='utf-8')
+
+
+def main():
+    args = parse_args()
+
+    config = get_config_from_generator()
+    if unknown := set(args.pin) - {tree['name'] for tree in config['trees']}:
+        die(f"Unknown trees passed to --pin: {', '.join(sorted(unknown))}")
+
+    schedules = dict(SCHEDULE_RE.findall(SCHEDULES_YML.read_text(encoding='utf-8')))
+    workflows = get_workflows(config, schedules)
+
+    before = [workflow['anchor'] for workflow in workflows]
+    after = optimize(workflows, schedules, set(args.pin))
+    before_load = get_week_load(workflows, schedules, before)
+    after_load = get_week_load(workflows, schedules, after)
+
+    changes = [
+        (workflow, anchor)
+        for workflow, anchor in zip(workflows, after)
+        if anchor != workflow['anchor']
+    ]
+    if changes:
+        print('Proposed schedule changes:\n')
+        width = max(
+            len(f"{workflow['name']} (clang-{workflow['llvm_version']})")
+            for workflow, _ in changes
+        )
+        for workflow, anchor in changes:
+            name = f"{workflow['name']} (clang-{workflow['llvm_version']})"
+            print(f"  {name:{width}}  {workflow['anchor']} -> {anchor}")
+        print()
+    else:
+        print('The current schedules are already balanced.\n')
+
+    print(f"Peak concurrent builds: {max(before_load)} -> {max(after_load)}")
+    print(
+        f"Hours at peak per week: {before_load.count(max(before_load))} -> {after_load.count(max(after_load))}"
+    )
+
+    if changes and args.write:
+        write_trees_yml(workflows, after)
+        print(
+            f"\n{TREES_YML.name} has been updated, run generator/generate.py to update the generated files."
+        )
+
+
+if __name__ == '__main__':
+    main()
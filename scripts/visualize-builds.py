@@ -11,7 +11,13 @@
 import argparse
 import csv
 import sys
-from utils import get_config_from_generator
+from utils import (
+    estimate_workflow_hours,
+    get_builds,
+    get_config_from_generator,
+    get_schedule_hours,
+    load_build_durations,
+)
 
 HOURS = 24
 
@@ -33,35 +39,22 @@ def generate_days():
 
 def populate_days(days):
     config = get_config_from_generator()
+    durations = load_build_durations()
     for tree in config["tree_schedules"]:
         name = tree["name"]
-
-        schedule = tree["schedule"].split(" ")
-        schedule_days = tuple(map(int, schedule[-1].split(",")))
-        schedule_hours = tuple(map(int, schedule[1].split(",")))
-
-        # Roughly estimate how many hours each build runs, rounded up to nearest whole hour
-        duration = 4  # assume older stable
-        if "android" in name or "tip" in name:
-            duration = 2
-        elif "mainline" in name or "stable" in name:
-            duration = 5
-        elif "next" in name:
-            duration = 6
-
-        for day in schedule_days:
-            for hour in schedule_hours:
-                for running_hour in range(hour, hour + duration):
-                    loop_day = day
-                    loop_hour = running_hour
-                    # handle builds crossing a day
-                    if loop_hour >= 24:
-                        loop_day += 1
-                        loop_hour -= 24
-                    # handle late night Sunday build crossing over to Monday
-                    if loop_day > 6:
-                        loop_day -= 6
-                    days[loop_day][loop_hour].append(name)
+        builds = [
+            build
+            for kind_builds in get_builds(config, name, tree["llvm_version"]).values()
+            for build in kind_builds
+        ]
+        duration = estimate_workflow_hours(name, builds, durations)
+
+        for day, hour in get_schedule_hours(tree["schedule"]):
+            for running_hour in range(hour, hour + duration):
+                # handle builds crossing a day, including late night Saturday
+                # builds crossing over to Sunday
+                loop_day, loop_hour = divmod(day * HOURS + running_hour, HOURS)
+                days[loop_day % len(days)][loop_hour].append(name)
 
 
 def visualize_data(days):
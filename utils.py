@@ -1,10 +1,12 @@
 import hashlib
 import json
+import math
 import os
 from pathlib import Path
+import pickle
 import sys
-from typing import Dict, Optional
-import urllib.request
+import tempfile
+from typing import Any, NamedTuple, Optional, Tuple, Union
 
 # anything that imports this will use uv, which ensures this will be available
 # in the environment
@@ -13,7 +15,49 @@ import yaml
 
 CI_ROOT = Path(__file__).resolve().parent
 GENERATOR_ROOT = Path(CI_ROOT, 'generator')
+# Local state for the generator that is not checked into the repository
+GENERATOR_CACHE = Path(GENERATOR_ROOT, '.cache')
+CONFIG_CACHE = Path(GENERATOR_CACHE, 'config.pickle')
 LLVM_TOT_VERSION = Path(GENERATOR_ROOT, 'LLVM_TOT_VERSION')
+# Median build durations fit from TuxSuite's builds.json files by
+# scripts/fit-build-durations.py
+BUILD_DURATIONS = Path(GENERATOR_ROOT, 'build_durations.json')
+
+# The kinds of configurations that builds are grouped into, which map directly
+# to the names of the TuxSuite jobs. The order is the order that jobs appear in
+# the generated files.
+CONFIG_KINDS = ('defconfigs', 'distribution_configs', 'allconfigs')
+
+# Rough guesses of how long a build of each kind of configuration takes in
+# seconds, used when BUILD_DURATIONS does not exist or has no data for a build.
+DEFAULT_BUILD_DURATIONS = {
+    'defconfigs': 15 * 60,
+    'distribution_configs': 30 * 60,
+    'allconfigs': 45 * 60,
+}
+
+# GitHub Actions allows at most this many jobs in a single workflow run:
+# https://docs.github.com/en/actions/reference/limits#existing-system-limits
+GITHUB_JOB_LIMIT = 256
+# Every generated workflow has a check_patches and check_cache job in addition
+# to the TuxSuite jobs and their per-build check jobs.
+WORKFLOW_SETUP_JOBS = 2
+
+
+# Aliases makes this YAML unreadable
+# https://ttl255.com/yaml-anchors-and-aliases-and-how-to-disable-them/
+class NoAliasDumper(yaml.SafeDumper):
+    def ignore_aliases(self, _data):
+        return True
+
+
+# libyaml's emitter is several times faster than the pure Python one and
+# results in identical output for the generated files, which
+# 'generate.py --check-emitter' verifies. Fall back to the pure Python emitter
+# if PyYAML was built without libyaml.
+class FastNoAliasDumper(getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
+    def ignore_aliases(self, _data):
+        return True
 
 
 def die(msg):
@@ -27,16 +71,353 @@ def die(msg):
 # disabled as well.
 def disable_subsys_werror_configs(configs):
     if 'CONFIG_WERROR=n' not in configs:
-        return
+        return configs
 
-    known_subsys_configs = ['CONFIG_DRM_WERROR=n']
-    for item in known_subsys_configs:
-        if item not in configs:
-            configs.append(item)
+    known_subsys_configs = ('CONFIG_DRM_WERROR=n',)
+    return (*configs, *(item for item in known_subsys_configs if item not in configs))
 
 
-def get_config_from_generator():
-    if not (all_generator_files := sorted(Path(GENERATOR_ROOT, 'yml').glob('*.yml'))):
+def get_config_kind(config):
+    cfg_str = str(config)
+    if "defconfig" in cfg_str:
+        return "defconfigs"
+    if "https://" in cfg_str:
+        return "distribution_configs"
+    return "allconfigs"
+
+
+class Build(NamedTuple):
+    """
+    A single build from the generator configuration, with anchors and merge
+    keys resolved. Builds are immutable and share their strings and tuples
+    with all other builds that have the same values, as there are thousands
+    of builds but only a handful of distinct repositories, configurations,
+    and make variables.
+    """
+
+    git_repo: str
+    git_ref: str
+    llvm_version: Union[int, str]
+    arch: str
+    # Either a single configuration target or a tuple of a configuration
+    # target and additional configurations or fragments, which is preserved
+    # because it determines how the build is rendered.
+    config: Union[str, Tuple[str, ...]]
+    targets: Tuple[str, ...]
+    kernel_image: Optional[str]
+    # Tuple of (name, value) pairs in the order they were specified, or None
+    # if the build has no make variables.
+    make_variables: Optional[Tuple[Tuple[str, Any], ...]]
+    boot: bool
+    # Derived from the values above when the build is created
+    kind: str
+    job_name: str
+
+    @property
+    def config_name(self):
+        return self.config if isinstance(self.config, str) else '+'.join(self.config)
+
+
+def _share(value, shared):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        value = tuple(_share(item, shared) for item in value)
+    return shared.setdefault(value, value)
+
+
+def get_job_name(arch, boot, make_variables, llvm_version, config_name):
+    job = "ARCH=" + arch
+    # BOOT=1 is the default, only show if we have disabled it
+    if not boot:
+        job += " BOOT=0"
+    # LLVM=0 does not make much sense. Translate LLVM=0 into CC=clang
+    if "LLVM" in make_variables:
+        job += " LLVM=1"
+    else:
+        job += " CC=clang"
+    # If LD was specified, show what it is
+    if "LD" in make_variables:
+        job += " LD=" + str(make_variables["LD"])
+    job += " LLVM_IAS=" + str(make_variables["LLVM_IAS"])
+    # Having "LLVM <VER>" is a little hard to parse, make it look like
+    # an environment variable
+    job += " LLVM_VERSION=" + str(llvm_version)
+    job += " " + config_name
+    return job
+
+
+def make_build(build, shared=None):
+    """
+    Convert a build from the generator configuration into a Build. Values are
+    deduplicated against the ones already in shared, if provided.
+    """
+    if shared is None:
+        shared = {}
+
+    arch = _share(build.get("ARCH", "x86_64"), shared)
+    config = build["config"]
+    if not isinstance(config, str):
+        config = disable_subsys_werror_configs(config)
+    config = _share(config, shared)
+    config_name = config if isinstance(config, str) else '+'.join(config)
+    if (make_variables := build.get("make_variables")) is not None:
+        make_variables = _share(tuple(make_variables.items()), shared)
+
+    return Build(
+        git_repo=_share(build["git_repo"], shared),
+        git_ref=_share(build["git_ref"], shared),
+        llvm_version=build["llvm_version"],
+        arch=arch,
+        config=config,
+        targets=_share(build["targets"], shared),
+        kernel_image=build.get("kernel_image"),
+        make_variables=make_variables,
+        boot=build["boot"],
+        kind=get_config_kind(config),
+        job_name=sys.intern(
+            get_job_name(
+                arch,
+                build["boot"],
+                dict(make_variables or ()),
+                build["llvm_version"],
+                config_name,
+            )
+        ),
+    )
+
+
+def get_build_index(config):
+    """
+    Group the builds in config["builds"] by (git_repo, git_ref, llvm_version),
+    then by the kind of configuration (see CONFIG_KINDS), preserving the order
+    of builds within each bucket.
+
+    The builds are converted into Build records and the index is built once
+    and stored alongside the builds, so that every (tree, LLVM version) pair
+    can look up its builds without walking the whole list again.
+    """
+    if "build_index" not in config:
+        shared = {}
+        builds = tuple(
+            build if isinstance(build, Build) else make_build(build, shared)
+            for build in config["builds"]
+        )
+        index = {}
+        for build in builds:
+            key = (build.git_repo, build.git_ref, build.llvm_version)
+            if key not in index:
+                index[key] = {kind: [] for kind in CONFIG_KINDS}
+            index[key][build.kind].append(build)
+        config["builds"] = builds
+        config["build_index"] = index
+    return config["build_index"]
+
+
+def get_builds(config, tree_name, llvm_version):
+    repo, ref = get_repo_ref(config, tree_name)
+    if (builds := get_build_index(config).get((repo, ref, llvm_version))) is None:
+        return {kind: [] for kind in CONFIG_KINDS}
+    return builds
+
+
+def get_tree_schedule(config, tree_name, llvm_version):
+    for item in config['tree_schedules']:
+        if item['name'] == tree_name and item['llvm_version'] == llvm_version:
+            return item
+    return None
+
+
+def partition_builds(builds, num_jobs, max_builds, durations):
+    """
+    Partition builds into at least num_jobs lists of at most max_builds builds
+    of similar estimated total cost, from the quickest builds to the slowest.
+
+    The builds are sorted by their estimated durations and split into
+    contiguous lists, so that quick builds end up together rather than next to
+    the slowest ones. Of all the splits, the one whose most expensive list
+    (the total estimated duration of its builds) is the cheapest is used. Ties
+    are broken by keeping the costs of the lists as even as possible and then
+    by the total of every build's wait, as TuxSuite runs the builds of a job in
+    parallel, so the check jobs of all of its builds wait on its slowest build.
+    Builds keep their original order within each list.
+    """
+    num_jobs = min(max(num_jobs, math.ceil(len(builds) / max_builds)), len(builds))
+    costs = [estimate_build_duration(build, durations) for build in builds]
+    # sorted() is stable, so builds with equal costs stay in order
+    order = sorted(range(len(builds)), key=costs.__getitem__)
+    totals = [0]
+    for idx in order:
+        totals.append(totals[-1] + costs[idx])
+
+    def get_starts(jobs, end):
+        return range(max(jobs - 1, end - max_builds), end)
+
+    # highest[jobs][end] is the lowest cost of the most expensive list when
+    # the quickest end builds are split into that many lists.
+    highest = [[math.inf] * (len(builds) + 1) for _ in range(num_jobs + 1)]
+    highest[0][0] = 0
+    for jobs in range(1, num_jobs + 1):
+        for end in range(jobs, len(builds) + 1):
+            highest[jobs][end] = min(
+                max(highest[jobs - 1][start], totals[end] - totals[start])
+                for start in get_starts(jobs, end)
+            )
+    limit = highest[num_jobs][len(builds)]
+
+    # scores[jobs][end] is the lowest (sum of the squared costs of the lists,
+    # total wait) of the quickest end builds in that many lists that cost no
+    # more than limit and starts[jobs][end] where the last of those lists
+    # starts, as the slowest build of a list is always its last one.
+    scores = [[(math.inf, math.inf)] * (len(builds) + 1) for _ in range(num_jobs + 1)]
+    starts = [[0] * (len(builds) + 1) for _ in range(num_jobs + 1)]
+    scores[0][0] = (0, 0)
+    for jobs in range(1, num_jobs + 1):
+        for end in range(jobs, len(builds) + 1):
+            slowest = costs[order[end - 1]]
+            for start in get_starts(jobs, end):
+                if (cost := totals[end] - totals[start]) > limit:
+                    continue
+                squares, wait = scores[jobs - 1][start]
+                score = (squares + cost**2, wait + (end - start) * slowest)
+                if score < scores[jobs][end]:
+                    scores[jobs][end], starts[jobs][end] = score, start
+
+    parts = []
+    end = len(builds)
+    for jobs in range(num_jobs, 0, -1):
+        start = starts[jobs][end]
+        parts.append(sorted(order[start:end]))
+        end = start
+    return [[builds[idx] for idx in part] for part in reversed(parts)]
+
+
+def get_tuxsuite_jobs(config, tree_name, llvm_version, max_builds=None):
+    """
+    Returns a list of (job_name, builds) tuples, one per TuxSuite job for
+    tree_name and llvm_version, in the order that they appear in the generated
+    files.
+
+    By default, there is one job per kind of configuration that has builds,
+    except for defconfigs, which is always present. A job with more builds than
+    can fit into a single workflow alongside its kick job (or max_builds, if
+    provided) is split into several jobs of at most that size, named '<kind>',
+    '<kind>_2', '<kind>_3', and so on.
+
+    If the tree schedule has a 'tuxsuite_jobs' value, the builds are instead
+    partitioned into that many jobs of roughly equal estimated cost (see
+    partition_builds()), named 'builds_1', 'builds_2', and so on from the
+    quickest builds to the slowest, so that the check jobs of quick builds do
+    not have to wait on the slowest builds.
+    """
+    if max_builds is None:
+        max_builds = GITHUB_JOB_LIMIT - WORKFLOW_SETUP_JOBS - 1
+
+    builds_by_kind = get_builds(config, tree_name, llvm_version)
+
+    schedule = get_tree_schedule(config, tree_name, llvm_version) or {}
+    if (num_jobs := schedule.get('tuxsuite_jobs')) and (
+        builds := [build for builds in builds_by_kind.values() for build in builds]
+    ):
+        parts = partition_builds(builds, num_jobs, max_builds, load_build_durations())
+        return [(f"builds_{idx}", part) for idx, part in enumerate(parts, 1)]
+
+    jobs = []
+    for kind, builds in builds_by_kind.items():
+        if not builds and kind != 'defconfigs':
+            continue
+        chunks = [builds[i : i + max_builds] for i in range(0, len(builds), max_builds)]
+        for idx, chunk in enumerate(chunks or [builds], 1):
+            jobs.append((kind if idx == 1 else f"{kind}_{idx}", chunk))
+    return jobs
+
+
+def get_workflow_shards(tuxsuite_jobs):
+    """
+    Split the (job_name, builds) tuples from get_tuxsuite_jobs() into groups
+    that each fit into a single workflow, which has to hold the setup jobs, a
+    kick job for each TuxSuite job, and a check job for each build.
+    """
+    budget = GITHUB_JOB_LIMIT - WORKFLOW_SETUP_JOBS
+    shards = [[]]
+    used = 0
+    for job in tuxsuite_jobs:
+        cost = 1 + len(job[1])
+        if shards[-1] and used + cost > budget:
+            shards.append([])
+            used = 0
+        shards[-1].append(job)
+        used += cost
+    return shards
+
+
+def get_workflows(config, tree_name, llvm_version):
+    """
+    Returns a list of (github_yml, workflow_name, tuxsuite_jobs) tuples, one
+    per GitHub Actions workflow of tree_name and llvm_version, where
+    tuxsuite_jobs are the (job_name, builds) tuples from get_tuxsuite_jobs()
+    that the workflow runs.
+
+    There is normally a single workflow, '<tree>-clang-<ver>.yml' named
+    '<tree> (clang-<ver>)', but if the builds do not fit within GitHub's limit
+    on the number of jobs in a workflow, they are sharded across several
+    workflows, '<tree>-clang-<ver>-<n>.yml' named
+    '<tree> (clang-<ver>) [<n>/<total>]'.
+    """
+    toolchain = f'clang-{llvm_version}'
+    shards = get_workflow_shards(get_tuxsuite_jobs(config, tree_name, llvm_version))
+    if len(shards) == 1:
+        return [
+            (
+                f'.github/workflows/{tree_name}-{toolchain}.yml',
+                f'{tree_name} ({toolchain})',
+                shards[0],
+            )
+        ]
+    return [
+        (
+            f'.github/workflows/{tree_name}-{toolchain}-{idx}.yml',
+            f'{tree_name} ({toolchain}) [{idx}/{len(shards)}]',
+            shard,
+        )
+        for idx, shard in enumerate(shards, 1)
+    ]
+
+
+def _load_config_cache(key):
+    try:
+        with CONFIG_CACHE.open('rb') as file:
+            cached = pickle.load(file)
+    # A missing, truncated, or otherwise unreadable cache is just a cache miss
+    # pylint: disable-next=broad-exception-caught
+    except Exception:
+        return None
+    return cached['config'] if cached.get('key') == key else None
+
+
+def _save_config_cache(key, config):
+    CONFIG_CACHE.parent.mkdir(exist_ok=True, parents=True)
+    # Write to a temporary file then move it into place so that concurrent
+    # invocations never see a partially written cache.
+    with tempfile.NamedTemporaryFile(
+        dir=CONFIG_CACHE.parent, prefix=f"{CONFIG_CACHE.name}.", delete=False
+    ) as file:
+        pickle.dump(
+            {'key': key, 'config': config}, file, protocol=pickle.HIGHEST_PROTOCOL
+        )
+    Path(file.name).replace(CONFIG_CACHE)
+
+
+def get_config_from_generator(
+    use_cache=True, yml_dir=Path(GENERATOR_ROOT, 'yml'), index_builds=True
+):
+    """
+    Returns the parsed generator configuration, with its builds converted into
+    Build records and indexed (see get_build_index()) unless index_builds is
+    False, in which case they are left as they are in the YAML until they are
+    first looked up. Only an indexed configuration is cached.
+    """
+    if not (all_generator_files := sorted(Path(yml_dir).glob('*.yml'))):
         return die('No generator files could not be found?')
 
     generator_pieces = []
@@ -44,10 +425,38 @@ def get_config_from_generator():
         if '-llvm-' in file.name and 'builds:\n' not in generator_pieces:
             generator_pieces.append('builds:\n')
         generator_pieces.append(file.read_text(encoding='utf-8'))
+    generator_yml = ''.join(generator_pieces)
+
+    # The parsed configuration depends on the generator files, this file (as
+    # it builds the index that is cached along with the configuration), and
+    # the version of PyYAML that parsed it.
+    hasher = hashlib.blake2b(generator_yml.encode('utf-8'))
+    hasher.update(Path(__file__).read_bytes())
+    hasher.update(yaml.__version__.encode('utf-8'))
+    cache_key = hasher.hexdigest()
+
+    if (
+        use_cache
+        and index_builds
+        and (config := _load_config_cache(cache_key)) is not None
+    ):
+        return config
 
     # Trusted input.
     # https://github.com/yaml/pyyaml/wiki/PyYAML-yaml.load(input)-Deprecation
-    return yaml.load(''.join(generator_pieces), Loader=yaml.FullLoader)
+    # Prefer the libyaml based loader, which is much faster, when available.
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+    config = yaml.load(generator_yml, Loader=loader)
+    if not index_builds:
+        return config
+    get_build_index(config)
+
+    if use_cache:
+        try:
+            _save_config_cache(cache_key, config)
+        except OSError as err:
+            warn(f"Could not save parsed configuration cache ('{err}')")
+    return config
 
 
 def get_image_name():
@@ -199,22 +608,229 @@ def get_repo_ref(config, tree_name):
     return die(f"Could not find git repo and ref for {tree_name}?")
 
 
+def get_git_refs(config, git_repo):
+    """
+    Returns the refs of every tree that is built from git_repo, which
+    caching/check.py resolves at once (see caching/refs.py).
+    """
+    return sorted(
+        {tree["git_ref"] for tree in config["trees"] if tree["git_repo"] == git_repo}
+    )
+
+
 def get_llvm_versions(config, tree_name):
-    llvm_versions = set()
     repo, ref = get_repo_ref(config, tree_name)
-    for build in config["builds"]:
-        if build["git_repo"] == repo and build["git_ref"] == ref:
-            llvm_versions.add(build["llvm_version"])
-    return llvm_versions
+    return {
+        llvm_version
+        for (build_repo, build_ref, llvm_version) in get_build_index(config)
+        if build_repo == repo and build_ref == ref
+    }
+
+
+def get_schedule_hours(schedule):
+    """
+    Returns a (day, hour) tuple for every time that a cron schedule of the form
+    used in 0003-schedules.yml ('0 <hours> * * <days>') fires during a week,
+    where day is 0 (Sunday) through 6 (Saturday), like cron.
+    """
+    fields = schedule.split(' ')
+    hours = tuple(map(int, fields[1].split(',')))
+    days = tuple(map(int, fields[-1].split(',')))
+    return [(day, hour) for day in days for hour in hours]
+
+
+def get_tuxsuite_toolchain(llvm_version):
+    if llvm_version == int(LLVM_TOT_VERSION.read_text(encoding='utf-8')):
+        return "clang-nightly"
+    if llvm_version == "android":
+        return "clang-android"
+    # We want to use the kernel.org LLVM builds for speed but
+    # we don't want korg everywhere
+    return f"korg-clang-{llvm_version}"
+
+
+def get_toolchain_image(config, toolchain):
+    """
+    Returns the reference of the tuxmake image of toolchain (like
+    'korg-clang-21') from the 'toolchain_image' of the configuration.
+    """
+    return config['toolchain_image'].format(toolchain=toolchain)
+
+
+def get_build_duration_key(arch, kind, toolchain):
+    """
+    Returns the keys used in the tables of BUILD_DURATIONS for a build, from
+    the most to the least specific.
+    """
+    return {
+        'by_arch_kind_toolchain': f"{arch}/{kind}/{toolchain}",
+        'by_arch_kind': f"{arch}/{kind}",
+        'by_kind': kind,
+    }
+
+
+def load_build_durations(file=BUILD_DURATIONS):
+    try:
+        return json.loads(Path(file).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+
+
+def estimate_build_duration(build, durations, toolchain=None):
+    """
+    Estimate how many seconds a Build takes with the model from
+    load_build_durations(), falling back to less specific estimates when there
+    is no data for its architecture or toolchain and DEFAULT_BUILD_DURATIONS
+    when there is no model at all.
+    """
+    if durations:
+        if toolchain is None:
+            toolchain = get_tuxsuite_toolchain(build.llvm_version)
+        for table, key in get_build_duration_key(
+            build.arch, build.kind, toolchain
+        ).items():
+            if (entry := durations.get(table, {}).get(key)) is not None:
+                return entry['duration']
+    return DEFAULT_BUILD_DURATIONS[build.kind]
+
+
+def estimate_workflow_hours(tree_name, builds=None, durations=None):
+    """
+    Roughly estimate how many hours a workflow of tree_name runs, rounded up to
+    the nearest whole hour.
+
+    With a build duration model, TuxSuite runs all of the builds of a workflow
+    in parallel, so it takes about as long as its slowest build.
+    """
+    if builds and durations:
+        toolchain = get_tuxsuite_toolchain(builds[0].llvm_version)
+        slowest = max(
+            estimate_build_duration(build, durations, toolchain) for build in builds
+        )
+        return max(1, math.ceil(slowest / 3600))
+    if "android" in tree_name or "tip" in tree_name:
+        return 2
+    if "mainline" in tree_name or "stable" in tree_name:
+        return 5
+    if "next" in tree_name:
+        return 6
+    # assume older stable
+    return 4
+
+
+# Size of the chunks that files are hashed in
+HASH_CHUNK_SIZE = 64 * 1024
+# The hashes of the patches that have been hashed before, keyed by their path
+# and kept with the size and mtime that they had then, so that a patch is only
+# read again when it changes. It is kept next to the configuration cache so
+# that every process (such as the workers of the generator) can use it.
+PATCH_HASHES_CACHE = Path(GENERATOR_CACHE, 'patch_hashes.json')
+_patch_hashes = {}
+
+
+def _load_patch_hashes():
+    try:
+        return json.loads(PATCH_HASHES_CACHE.read_text(encoding='utf-8'))
+    # A missing or otherwise unreadable cache is just a cache miss
+    # pylint: disable-next=broad-exception-caught
+    except Exception:
+        return {}
+
+
+def _save_patch_hashes(hashes):
+    PATCH_HASHES_CACHE.parent.mkdir(exist_ok=True, parents=True)
+    # Drop the patches that are gone, then write to a temporary file and move
+    # it into place like _save_config_cache()
+    hashes = {path: entry for path, entry in hashes.items() if Path(path).exists()}
+    with tempfile.NamedTemporaryFile(
+        'w',
+        dir=PATCH_HASHES_CACHE.parent,
+        prefix=f"{PATCH_HASHES_CACHE.name}.",
+        delete=False,
+        encoding='utf-8',
+    ) as file:
+        json.dump(hashes, file, indent=0)
+    Path(file.name).replace(PATCH_HASHES_CACHE)
+
+
+def get_patch_hash(patch, hashes):
+    """
+    Returns the blake2b of the contents of patch, from hashes (a cache from
+    _load_patch_hashes()) if it has not changed since, adding it otherwise.
+    The file is streamed through the hash rather than read into memory at
+    once.
+    """
+    stat = patch.stat()
+    if (entry := hashes.get(str(patch))) is not None and entry[:2] == [
+        stat.st_size,
+        stat.st_mtime_ns,
+    ]:
+        return entry[2]
+
+    hasher = hashlib.blake2b()
+    with patch.open('rb') as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    hashes[str(patch)] = [stat.st_size, stat.st_mtime_ns, hasher.hexdigest()]
+    return hashes[str(patch)][2]
 
 
 def get_patches_hash(tree_name):
+    """
+    Returns the blake2b of the hashes of every file in patches/<tree_name>
+    (see get_patch_hash()), in order, so that only the files that changed
+    since they were last hashed have to be read.
+
+    In a workflow, this is the PATCHES_HASH that the generator put into its
+    environment, as the generated files are checked to be up to date with the
+    patches in CI, so the patches do not have to be read at all.
+    """
+    workflow_tree = os.environ.get('GITHUB_WORKFLOW', '').split(' ', 1)[0]
+    if (patches_hash := os.environ.get('PATCHES_HASH')) and workflow_tree == tree_name:
+        return patches_hash
+
+    if not _patch_hashes:
+        _patch_hashes.update(_load_patch_hashes())
+    known = dict(_patch_hashes)
+
     patches_folder = Path(CI_ROOT, 'patches', tree_name)
-    patches = sorted(patches_folder.iterdir()) if patches_folder.exists() else []
+    hasher = hashlib.blake2b()
+    if patches_folder.exists():
+        for item in sorted(patches_folder.iterdir()):
+            hasher.update(bytes.fromhex(get_patch_hash(item, _patch_hashes)))
 
-    text = ''.join(item.read_text(encoding='utf-8') for item in patches)
+    if _patch_hashes != known:
+        try:
+            _save_patch_hashes(_patch_hashes)
+        except OSError as err:
+            warn(f"Could not save the hashes of the patches ('{err}')")
+    return hasher.hexdigest()
 
-    return hashlib.blake2b(text.encode()).hexdigest()
+
+def normalize_make_variables(make_variables):
+    """
+    Returns make_variables from a TuxSuite plan, builds.json, or a Build as a
+    dictionary of strings. The plans have integers where builds.json has the
+    strings that TuxSuite turned them into (LLVM: 1 vs. LLVM: '1'), which
+    would otherwise make the same build look different on either side.
+    """
+    return {str(name): str(value) for name, value in dict(make_variables or {}).items()}
+
+
+def get_build_cache_key(target_arch, kconfig, make_variables):
+    """
+    Returns the key of a build within the cache entry of its workflow, from
+    its target_arch, kconfig, and make_variables as they appear in a TuxSuite
+    plan, builds.json, or a Build. It is kept short so that the results of
+    every build in a workflow fit into a single Repository Variable.
+    """
+    spec = {
+        'target_arch': target_arch,
+        'kconfig': [kconfig] if isinstance(kconfig, str) else list(kconfig),
+        'make_variables': normalize_make_variables(make_variables),
+    }
+    text = json.dumps(spec, sort_keys=True)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=6).hexdigest()
 
 
 def get_workflow_name_to_var_name(workflow_name: str) -> str:
@@ -231,72 +847,6 @@ def get_workflow_name_to_var_name(workflow_name: str) -> str:
     return "_" + "".join([x for x in workflow_name if x.isalnum()]).upper()
 
 
-def update_repository_variable(
-    key: str,
-    http_headers: Dict[str, str],
-    *,
-    sha: Optional[str] = None,
-    clang_version: Optional[str] = None,
-    patches_hash: Optional[str] = None,
-    build_status: Optional[str] = None,
-    other: Optional[Dict[str, str]] = None,
-    allow_fail_to_pass=False,  # should a cache entry be allowed to go from 'fail' to 'pass'
-):
-    """
-    Update cache entries.
-
-    Only non-None fields are updated, the others remain as they are in the cache.
-
-    Use `other` to provide more values than what is supported as keyword args.
-    """
-    url = f"https://api.github.com/repos/ClangBuiltLinux/continuous-integration2/actions/variables/{key}"
-
-    # this REPO_SCOPED_PAT comes from GitHub Actions repository secrets
-    # if we aren't running in a workflow a KeyError is raised and caught by caller
-    # you may manually set this in your environment as well.
-    request = urllib.request.Request(url, headers=http_headers)
-
-    with urllib.request.urlopen(request) as response:
-        content = response.read().decode("utf-8")
-        data = json.loads(content)
-        cached_value = json.loads(data["value"])
-        print(f"{cached_value=}")
-        if sha:
-            cached_value["linux_sha"] = sha
-        if clang_version:
-            cached_value["clang_version"] = clang_version
-        if patches_hash:
-            cached_value["patches_hash"] = patches_hash
-        if build_status:
-            if (
-                not allow_fail_to_pass
-                and cached_value['build_status'] == 'fail'
-                and build_status == 'pass'
-            ):
-                ...
-            else:
-                cached_value["build_status"] = build_status
-        if other and isinstance(other, dict):
-            for k, v in other.items():
-                cached_value[k] = v
-
-        cached_value = json.dumps(cached_value)
-
-    new_value = json.dumps({"name": key, "value": cached_value}).encode("utf-8")
-    update_request = urllib.request.Request(
-        url, data=new_value, method="PATCH", headers=http_headers
-    )
-    urllib.request.urlopen(update_request)  # pylint: disable=consider-using-with
-
-    print(f"""\
-        Updated cache entry with fields:
-        {build_status=}
-        {sha=}
-        {clang_version=}
-        {patches_hash=}
-    """)
-
-
 def print_red(msg):
     print(f"\033[91m{msg}\033[0m", file=sys.stderr)
     sys.stderr.flush()
@@ -313,5 +863,20 @@ def patch_series_flag(tree):
     return f"--patch-series {patches_folder} " if patch_files else ""
 
 
+def write_if_changed(file, text):
+    """
+    Write text to file only if its contents would change, so that the
+    modification time of unchanged files (and anything keyed on it) is
+    preserved. Returns True if the file was written.
+    """
+    try:
+        if file.read_text(encoding='utf-8') == text:
+            return False
+    except FileNotFoundError:
+        pass
+    file.write_text(text, encoding='utf-8')
+    return True
+
+
 def warn(msg):
     print_yellow(f"WARNING: {msg}")